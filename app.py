@@ -1,15 +1,35 @@
-from flask import Flask, render_template, request, send_file, jsonify, send_from_directory
+from flask import Flask, Response, g, render_template, request, send_file, jsonify, send_from_directory, stream_with_context, url_for
 import os
 import sys
 import re
 import csv
 import base64
 import json
-import urllib.request
+import urllib.parse
+import email.utils
+import http.client
+import hashlib
+import hmac
+import importlib.util
+import multiprocessing
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 import fitz  # PyMuPDF
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-from datetime import datetime
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, NamedStyle
+from array import array
+from datetime import date, datetime
+from itertools import groupby
 import zipfile
 from io import BytesIO, StringIO
 
@@ -23,6 +43,188 @@ os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
+app.config['UPLOAD_SPOOL_THRESHOLD'] = int(os.environ.get('UPLOAD_SPOOL_THRESHOLD', 8 * 1024 * 1024))  # larger uploads are read from disk
+
+# Vision API (override the URL to point at a local stub server when testing)
+app.config['VISION_API_URL'] = os.environ.get('ANTHROPIC_API_URL', 'https://api.anthropic.com/v1/messages')
+app.config['VISION_MAX_WORKERS'] = int(os.environ.get('VISION_MAX_WORKERS', 4))  # requests in flight
+app.config['VISION_REQUEST_TIMEOUT'] = float(os.environ.get('VISION_REQUEST_TIMEOUT', 90))  # seconds per page
+app.config['VISION_DEADLINE'] = float(os.environ.get('VISION_DEADLINE', 240))  # seconds per document
+app.config['VISION_RATE_LIMIT'] = float(os.environ.get('VISION_RATE_LIMIT', 50))  # requests per minute, per process
+app.config['VISION_BURST'] = int(os.environ.get('VISION_BURST', 4))  # requests allowed back to back
+app.config['VISION_MAX_RETRIES'] = int(os.environ.get('VISION_MAX_RETRIES', 3))  # per page, on 429/5xx/529
+app.config['VISION_BACKOFF_BASE'] = float(os.environ.get('VISION_BACKOFF_BASE', 1.0))  # seconds, doubled per retry
+app.config['VISION_BACKOFF_MAX'] = float(os.environ.get('VISION_BACKOFF_MAX', 30))  # seconds
+app.config['VISION_PAGES_PER_REQUEST'] = int(os.environ.get('VISION_PAGES_PER_REQUEST', 1))  # >1 batches consecutive pages
+app.config['VISION_BATCH_MAX_BYTES'] = int(os.environ.get('VISION_BATCH_MAX_BYTES', 2 * 1024 * 1024))  # image bytes per batch
+app.config['VISION_MAX_CONTINUATIONS'] = int(os.environ.get('VISION_MAX_CONTINUATIONS', 2))  # follow-ups per truncated reply
+
+# Page images sent to vision: scans are re-encoded and renders sized to these budgets
+app.config['VISION_MAX_PIXELS'] = int(os.environ.get('VISION_MAX_PIXELS', 1600000))  # per page image
+app.config['VISION_MAX_IMAGE_BYTES'] = int(os.environ.get('VISION_MAX_IMAGE_BYTES', 400 * 1024))  # per page JPEG
+app.config['VISION_JPEG_QUALITY'] = int(os.environ.get('VISION_JPEG_QUALITY', 80))  # starting quality
+app.config['VISION_GRAYSCALE'] = os.environ.get('VISION_GRAYSCALE', 'true') == 'true'
+app.config['VISION_CROP'] = os.environ.get('VISION_CROP', 'true') == 'true'  # trim blank margins
+
+# Converted-statement cache (raw transactions keyed by PDF content)
+app.config['RESULT_CACHE_SIZE'] = int(os.environ.get('RESULT_CACHE_SIZE', 128))  # entries in memory
+app.config['RESULT_CACHE_DISK'] = os.environ.get('RESULT_CACHE_DISK') == 'true'  # also keep under OUTPUT_FOLDER
+app.config['RESULT_CACHE_TTL'] = float(os.environ.get('RESULT_CACHE_TTL', 24 * 3600))  # seconds
+
+# Per-page vision cache (parsed rows keyed by page image + model/prompt)
+app.config['VISION_CACHE_SIZE'] = int(os.environ.get('VISION_CACHE_SIZE', 512))  # pages in memory
+app.config['VISION_CACHE_DISK'] = os.environ.get('VISION_CACHE_DISK') == 'true'  # also keep under OUTPUT_FOLDER
+app.config['VISION_CACHE_TTL'] = float(os.environ.get('VISION_CACHE_TTL', 7 * 24 * 3600))  # seconds
+
+# Process pool for multi-file /convert batches (1 converts inline)
+app.config['CONVERT_WORKERS'] = int(os.environ.get('CONVERT_WORKERS', os.cpu_count() or 1))
+
+# Background conversion jobs (/jobs)
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))  # files converted at once
+app.config['JOB_TTL'] = float(os.environ.get('JOB_TTL', 24 * 3600))  # seconds before a job is purged
+app.config['CHUNK_PAGES'] = int(os.environ.get('CHUNK_PAGES', 20))  # default pages per /convert/chunk request
+app.config['CURSOR_SECRET'] = os.environ.get('CURSOR_SECRET', '')  # signs chunk cursors; unset, a key is kept with the jobs
+
+# /admin routes require a matching X-Admin-Token header; unset, they are disabled (403)
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN', '')
+
+# 'debug' also logs the full text of every text page
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'info').lower()
+
+# ─────────────────────────────────────────────
+# METRICS
+# ─────────────────────────────────────────────
+
+# Upper bounds (seconds) of the stage and request duration histograms
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRIC_HELP = {
+    'statement_stage_seconds': ('histogram', 'Time spent in each conversion stage, excluding nested stages.'),
+    'statement_pages_total': ('counter', 'PDF pages converted, by route.'),
+    'vision_requests_total': ('counter', 'Messages API requests that returned a response.'),
+    'vision_tokens_total': ('counter', 'Messages API usage tokens, by type (input or output).'),
+    'http_request_duration_seconds': ('histogram', 'Request handling time, by endpoint.'),
+    'http_requests_total': ('counter', 'Requests handled, by endpoint and status code.'),
+}
+
+class Metrics:
+    """Process-wide counters and histograms, rendered for Prometheus by /metrics.
+
+    Stage timers are exclusive: time spent in a timer nested inside another
+    on the same thread (parsing driven by the output writer, page images
+    inside text extraction) counts only towards the inner stage. Stages are
+    upload_save, pdf_open, text_extract, page_image, bank_detect, parse,
+    vision_page, vision_batch, output_write and encode.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._counters = {}  # (name, labels) -> value
+        self._local = threading.local()
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            series = self._histograms.get((name, labels))
+            if series is None:
+                series = self._histograms[(name, labels)] = [0] * (len(METRIC_BUCKETS) + 2)
+            for i, bound in enumerate(METRIC_BUCKETS):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + amount
+
+    def _start(self):
+        self._local.__dict__.setdefault('nested', []).append(0.0)
+        return time.perf_counter()
+
+    def _stop(self, start):
+        """Exclusive seconds since start; the full time is charged to the enclosing timer"""
+        elapsed = time.perf_counter() - start
+        nested = self._local.nested
+        exclusive = elapsed - nested.pop()
+        if nested:
+            nested[-1] += elapsed
+        return exclusive
+
+    @contextmanager
+    def timer(self, stage):
+        start = self._start()
+        try:
+            yield
+        finally:
+            self.observe('statement_stage_seconds', (('stage', stage),), self._stop(start))
+
+    def timed_iter(self, stage, iterable):
+        """Yield from iterable, recording the time spent producing items as one observation"""
+        iterator = iter(iterable)
+        total = 0.0
+        try:
+            while True:
+                start = self._start()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    total += self._stop(start)
+                yield item
+        finally:
+            self.observe('statement_stage_seconds', (('stage', stage),), total)
+
+    def drain(self):
+        """Take everything recorded so far, leaving this registry empty"""
+        with self._lock:
+            taken = {'histograms': self._histograms, 'counters': self._counters}
+            self._histograms, self._counters = {}, {}
+        return taken
+
+    def merge(self, taken):
+        """Add what another process's drain() returned"""
+        with self._lock:
+            for key, series in taken['histograms'].items():
+                mine = self._histograms.setdefault(key, [0] * len(series))
+                for i, value in enumerate(series):
+                    mine[i] += value
+            for key, value in taken['counters'].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self):
+        """Prometheus text exposition format"""
+        def label_text(labels, *extra):
+            pairs = [f'{k}="{v}"' for k, v in labels + extra]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        with self._lock:
+            histograms = {key: list(series) for key, series in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = []
+        for name, (kind, help_text) in METRIC_HELP.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (series_name, labels), value in sorted(counters.items()):
+                    if series_name == name:
+                        lines.append(f'{name}{label_text(labels)} {value}')
+                continue
+            for (series_name, labels), series in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(METRIC_BUCKETS, series):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{label_text(labels, ("le", bound))} {cumulative}')
+                lines.append(f'{name}_bucket{label_text(labels, ("le", "+Inf"))} {series[-1]}')
+                lines.append(f'{name}_sum{label_text(labels)} {series[-2]:.6f}')
+                lines.append(f'{name}_count{label_text(labels)} {series[-1]}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
 
 # ─────────────────────────────────────────────
 # ABSA CHARACTER DECODING (for old-style PDFs)
@@ -85,53 +287,477 @@ ABSA_WORD_CORRECTIONS = {
     'ABSA.CO.ZA': 'ABSA.CO.ZA',
 }
 
+# Both lookups are compiled once at import: translate tables for the
+# character map and one longest-match-first pattern for the word corrections.
+# Every mapped character is Latin-1, so Latin-1 text goes through a 256-byte
+# bytes.translate table; anything wider falls back to str.translate.
+ABSA_TRANSLATION = str.maketrans(ABSA_CHAR_MAP)
+ABSA_BYTE_TABLE = bytes(ord(ABSA_CHAR_MAP.get(chr(i), chr(i))) for i in range(256))
+
+def _trie_pattern(words):
+    """Regex matching any of words, longest first, factored into a prefix trie.
+
+    Shared prefixes are tested once per position instead of once per word,
+    and at every node longer continuations are tried before stopping.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        alternatives = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if '' in node:
+            alternatives.append('')
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return '(?:' + '|'.join(alternatives) + ')'
+
+    return build(trie)
+
+ABSA_CORRECTIONS_RE = re.compile(_trie_pattern(ABSA_WORD_CORRECTIONS))
+
 def decode_absa_text(text):
     """Decode garbled ABSA PDF text using character map"""
-    result = ''
-    for char in text:
-        result += ABSA_CHAR_MAP.get(char, char)
-    return result
+    try:
+        return text.encode('latin-1').translate(ABSA_BYTE_TABLE).decode('latin-1')
+    except UnicodeEncodeError:
+        return text.translate(ABSA_TRANSLATION)
 
 def apply_word_corrections(text):
-    """Apply known word-level corrections to ABSA descriptions"""
-    for wrong, right in ABSA_WORD_CORRECTIONS.items():
-        text = text.replace(wrong, right)
-    return text
+    """Apply known word-level corrections to ABSA descriptions.
+
+    Single pass: at each position the longest matching entry wins, and
+    replaced text is never rescanned, so the result does not depend on
+    dictionary order (e.g. 'Acb Gerd/' vs 'Gerd/').
+    """
+    return ABSA_CORRECTIONS_RE.sub(lambda m: ABSA_WORD_CORRECTIONS[m.group()], text)
+
+# ─────────────────────────────────────────────
+# CACHES
+# ─────────────────────────────────────────────
+
+# Bump whenever a parser change alters extracted rows, so stale cache
+# entries are never served
+PARSER_VERSION = '3'
+
+class LRUCache:
+    """Thread-safe LRU cache with optional TTL and optional on-disk JSON tier.
+
+    The memory tier holds at most max_entries values. When disk_dir is set,
+    values are also written there as <key>.json, and files older than ttl
+    seconds are swept out by a put at most once per sweep_interval seconds
+    (an expired file is also dropped when it is read). Values must be
+    JSON-serialisable; lists of tuples come back from disk as lists of tuples.
+    """
+
+    def __init__(self, max_entries, ttl=None, disk_dir=None, sweep_interval=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.json')
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, value)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+        if self.disk_dir:
+            self._disk_put(key, value)
+
+    def _store(self, key, value):
+        self._entries[key] = (time.time(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if self._expired(os.path.getmtime(path)):
+                os.remove(path)
+                return None
+            with open(path, encoding='utf-8') as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if isinstance(value, list):
+            value = [tuple(v) if isinstance(v, list) else v for v in value]
+        return value
+
+    def _disk_put(self, key, value):
+        path = self._disk_path(key)
+        tmp_path = None
+        try:
+            # A unique temp file per write: processes sharing disk_dir may write the same key
+            fd, tmp_path = tempfile.mkstemp(prefix=f'{key}.', suffix='.tmp', dir=self.disk_dir)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[CACHE] Could not write {path}: {e}", file=sys.stderr)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        # Listing the directory is O(entries), so only one put per interval does it
+        with self._lock:
+            now = time.monotonic()
+            due = now >= self._next_sweep
+            if due:
+                self._next_sweep = now + self.sweep_interval
+        if due:
+            self.evict_expired()
+
+    def evict_expired(self):
+        """Drop expired entries from both tiers"""
+        with self._lock:
+            for key in [k for k, (t, _) in self._entries.items() if self._expired(t)]:
+                del self._entries[key]
+        if not self.disk_dir or self.ttl is None:
+            return
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            try:
+                if self._expired(os.path.getmtime(path)):
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def describe(self):
+        """Key and age in seconds of each in-memory entry, oldest use first"""
+        now = time.time()
+        with self._lock:
+            return [{'key': k, 'age': round(now - t, 1)} for k, (t, _) in self._entries.items()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                try:
+                    os.remove(os.path.join(self.disk_dir, name))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'disk': bool(self.disk_dir),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+def result_cache_key(source, page_range=None):
+    """SHA-256 of the PDF bytes (a path or the bytes themselves), page range and parser version"""
+    digest = hashlib.sha256()
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    else:
+        digest.update(source)
+    pages = '' if page_range is None else f'-p{page_range[0]}-{page_range[1]}'
+    return f'{digest.hexdigest()}{pages}-v{PARSER_VERSION}'
+
+result_cache = LRUCache(
+    app.config['RESULT_CACHE_SIZE'],
+    ttl=app.config['RESULT_CACHE_TTL'],
+    disk_dir=os.path.join(OUTPUT_FOLDER, 'result_cache') if app.config['RESULT_CACHE_DISK'] else None,
+)
+
+def vision_cache_key(img_bytes, batched=False):
+    """SHA-256 of a page image plus the model and prompts that read it.
+
+    A page read in a batched request (batched=True) was read with
+    VISION_BATCH_PROMPT, not VISION_USER_PROMPT, so it has its own key.
+    """
+    digest = hashlib.sha256()
+    for part in (VISION_MODEL, VISION_SYSTEM_PROMPT, VISION_BATCH_PROMPT if batched else VISION_USER_PROMPT):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    digest.update(img_bytes)
+    return digest.hexdigest()
+
+# Parsed vision rows per page image, so retries only pay for pages that missed
+vision_cache = LRUCache(
+    app.config['VISION_CACHE_SIZE'],
+    ttl=app.config['VISION_CACHE_TTL'],
+    disk_dir=os.path.join(OUTPUT_FOLDER, 'vision_cache') if app.config['VISION_CACHE_DISK'] else None,
+)
+
+# ─────────────────────────────────────────────
+# UPLOADS
+# ─────────────────────────────────────────────
+
+# Extraction takes a PDF source: a path, or the PDF bytes themselves.
+
+def read_upload(file):
+    """PDF source for an uploaded file, without a save-and-reopen round trip.
+
+    Uploads under UPLOAD_SPOOL_THRESHOLD are returned as bytes and opened
+    with fitz.open(stream=...). Larger ones are spooled once to a uniquely
+    named file in UPLOAD_FOLDER and returned as its path, so MuPDF reads
+    pages from disk on demand. Pass the result to release_upload when done.
+    """
+    with metrics.timer('upload_save'):
+        stream = file.stream
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+        if size < app.config['UPLOAD_SPOOL_THRESHOLD']:
+            return stream.read()
+        fd, path = tempfile.mkstemp(suffix='.pdf', dir=app.config['UPLOAD_FOLDER'])
+        with os.fdopen(fd, 'wb') as spool:
+            shutil.copyfileobj(stream, spool)
+        return path
+
+def release_upload(source):
+    """Remove the spool file behind a read_upload source, if it has one"""
+    if isinstance(source, str) and os.path.exists(source):
+        os.remove(source)
+
+def open_pdf(source):
+    """fitz document for a PDF source.
+
+    Open failures are raised as ValueError: fitz's own exceptions do not
+    pickle, and pool workers hand errors back to the parent.
+    """
+    try:
+        with metrics.timer('pdf_open'):
+            if isinstance(source, str):
+                return fitz.open(source)
+            return fitz.open(stream=source, filetype='pdf')
+    except Exception as e:
+        raise ValueError(f"Failed to open PDF: {e}") from None
+
+def describe_source(source):
+    """Short label for a PDF source in log lines"""
+    return source if isinstance(source, str) else f'<{len(source)} bytes>'
 
 # ─────────────────────────────────────────────
 # PDF TYPE DETECTION
 # ─────────────────────────────────────────────
 
-def is_image_based_pdf(pdf_path):
-    """Return True if PDF pages contain images only (no text layer)"""
+# Pages with fewer stripped text characters than this are treated as having
+# no usable text layer
+MIN_TEXT_CHARS = 50
+
+def load_pdf_pages(source, page_range=None):
+    """Open a PDF once and walk every page a single time.
+
+    Returns one record per page: text, stripped text length, whether the page
+    has an embedded image, and JPEG/image bytes for scanned pages (no usable
+    text layer, see needs_vision; None otherwise) with where they came from
+    (see _page_image_bytes). Every parser and the
+    vision path read from these records instead of reopening the document.
+    Pages in the old ABSA remapped font are decoded here and flagged
+    'garbled'. page_range=(start, stop) loads only those pages (0-based,
+    stop exclusive and clamped to the document).
+    """
+    doc = open_pdf(source)
+    pages = []
     try:
-        doc = fitz.open(pdf_path)
-        for page in doc:
-            text = page.get_text()
-            if text.strip():
-                return False
-        return True
-    except Exception:
-        return True
-
-def get_page_images_b64(pdf_path):
-    """Extract each page as a base64 JPEG from an image-based PDF"""
-    doc = fitz.open(pdf_path)
-    images = []
-    for page in doc:
-        d = page.get_text('rawdict')
-        blocks = d.get('blocks', [])
-        if blocks and blocks[0].get('type') == 1:
-            # Embedded JPEG/image
-            img_bytes = blocks[0]['image']
-            images.append(base64.b64encode(img_bytes).decode())
+        start, stop = page_range or (0, doc.page_count)
+        with metrics.timer('text_extract'):
+            for number in range(max(0, start), min(stop, doc.page_count)):
+                page = doc[number]
+                text = page.get_text()
+                garbled = is_garbled_absa_text(text)
+                if garbled:
+                    text = apply_word_corrections(decode_absa_text(text))
+                text_len = len(text.strip())
+                has_image = bool(page.get_images())
+                image = image_source = None
+                if text_len < MIN_TEXT_CHARS and has_image:
+                    with metrics.timer('page_image'):
+                        image, image_source = _page_image_bytes(page)
+                pages.append({
+                    'number': page.number,
+                    'text': text,
+                    'text_len': text_len,
+                    'garbled': garbled,
+                    'has_image': has_image,
+                    'image': image,
+                    'image_source': image_source,
+                })
+    finally:
+        doc.close()
+    return pages
+
+# Garbled-font detection looks at a fixed-size sample of each page
+GARBLE_SAMPLE_CHARS = 2000
+GARBLE_MIN_RATIO = 0.2  # share of non-space sample chars that are remapped glyphs
+
+# Only the non-ASCII keys of ABSA_CHAR_MAP are evidence of the remapped font;
+# the ASCII ones ('a', 'k', 'z', ...) occur in any clean text
+ABSA_GARBLED_CHARS = {ch for ch in ABSA_CHAR_MAP if ord(ch) > 127}
+ABSA_GARBLED_DELETE = str.maketrans(dict.fromkeys(ABSA_GARBLED_CHARS))
+
+def is_garbled_absa_text(text):
+    """True if a page's text uses the old ABSA remapped font encoding.
+
+    Clean pages are almost always pure ASCII, which is rejected by a single
+    isascii() call on the sample before any counting.
+    """
+    sample = text[:GARBLE_SAMPLE_CHARS]
+    if sample.isascii():
+        return False
+    visible = len(sample) - sample.count(' ') - sample.count('\n')
+    if visible <= 0:
+        return False
+    remapped = len(sample) - len(sample.translate(ABSA_GARBLED_DELETE))
+    return remapped / visible >= GARBLE_MIN_RATIO
+
+# ── Page images for vision ──
+#
+# An embedded scan within both budgets is sent as-is. Anything else is
+# rasterised (the scan decoded, or the page rendered) in grayscale, trimmed
+# to the area with ink on it, scaled to VISION_MAX_PIXELS and JPEG-encoded,
+# stepping quality and then size down until it fits VISION_MAX_IMAGE_BYTES.
+
+CROP_INK_LEVEL = 200  # gray values below this count as content when cropping
+CROP_MARGIN = 0.01  # share of each side kept around the content box
+CROP_SAMPLE_WIDTH = 200  # content box is found on a thumbnail this wide
+JPEG_MIN_QUALITY = 50
+JPEG_QUALITY_STEP = 15
+JPEG_SHRINK_STEP = 0.75  # scale applied once quality is at its minimum
+JPEG_MIN_PIXELS = 200000  # never shrink below this while chasing the byte budget
+
+def _gray_pixmap(pix):
+    """Grayscale (or RGB when VISION_GRAYSCALE is off) copy without alpha"""
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    target = fitz.csGRAY if app.config['VISION_GRAYSCALE'] else fitz.csRGB
+    if pix.colorspace is None or pix.colorspace.n != target.n:
+        pix = fitz.Pixmap(target, pix)
+    return pix
+
+def _content_box(pix):
+    """(x0, y0, x1, y1) pixel box around the inked area of pix, or None if blank"""
+    scale = min(1.0, CROP_SAMPLE_WIDTH / pix.width)
+    thumb = pix if scale == 1.0 else fitz.Pixmap(pix, max(1, int(pix.width * scale)), max(1, int(pix.height * scale)), None)
+    if thumb.n != 1:
+        thumb = fitz.Pixmap(fitz.csGRAY, thumb)
+    w, h, stride, samples = thumb.width, thumb.height, thumb.stride, thumb.samples
+    ink = bytes(range(CROP_INK_LEVEL))
+    rows = [y for y in range(h) if samples[y * stride:y * stride + w].translate(None, ink) != samples[y * stride:y * stride + w]]
+    if not rows:
+        return None
+    cols = [x for x in range(w) if any(samples[y * stride + x] < CROP_INK_LEVEL for y in rows)]
+    sx, sy = pix.width / w, pix.height / h
+    mx, my = pix.width * CROP_MARGIN, pix.height * CROP_MARGIN
+    return (max(0, int(cols[0] * sx - mx)), max(0, int(rows[0] * sy - my)),
+            min(pix.width, int((cols[-1] + 1) * sx + mx)), min(pix.height, int((rows[-1] + 1) * sy + my)))
+
+def _crop_pixmap(pix, box):
+    """Copy of the box region of pix"""
+    x0, y0, x1, y1 = box
+    if (x0, y0, x1, y1) == (0, 0, pix.width, pix.height):
+        return pix
+    n, stride, samples = pix.n, pix.stride, pix.samples
+    region = b''.join(samples[y * stride + x0 * n:y * stride + x1 * n] for y in range(y0, y1))
+    return fitz.Pixmap(pix.colorspace, x1 - x0, y1 - y0, region, 0)
+
+def _scaled_pixmap(pix, max_pixels):
+    """pix scaled down (never up) to at most max_pixels"""
+    pixels = pix.width * pix.height
+    if pixels <= max_pixels:
+        return pix
+    scale = (max_pixels / pixels) ** 0.5
+    return fitz.Pixmap(pix, max(1, int(pix.width * scale)), max(1, int(pix.height * scale)), None)
+
+def encode_vision_image(pix):
+    """Crop, scale and JPEG-encode a pixmap within the vision budgets"""
+    pix = _gray_pixmap(pix)
+    if app.config['VISION_CROP']:
+        box = _content_box(pix)
+        if box is not None:
+            pix = _crop_pixmap(pix, box)
+    max_pixels = app.config['VISION_MAX_PIXELS']
+    quality = app.config['VISION_JPEG_QUALITY']
+    while True:
+        pix = _scaled_pixmap(pix, max_pixels)
+        data = pix.tobytes('jpeg', jpg_quality=quality)
+        if len(data) <= app.config['VISION_MAX_IMAGE_BYTES']:
+            return data
+        if quality > JPEG_MIN_QUALITY:
+            quality = max(JPEG_MIN_QUALITY, quality - JPEG_QUALITY_STEP)
+        elif pix.width * pix.height > JPEG_MIN_PIXELS:
+            max_pixels = max(JPEG_MIN_PIXELS, int(pix.width * pix.height * JPEG_SHRINK_STEP))
         else:
-            # Render page as image if no embedded image found
-            mat = fitz.Matrix(2, 2)
-            pix = page.get_pixmap(matrix=mat)
-            img_bytes = pix.tobytes('jpeg')
-            images.append(base64.b64encode(img_bytes).decode())
-    return images
+            return data  # smallest we are willing to go
+
+def _page_image_bytes(page):
+    """(JPEG/image bytes, source) for a scanned page, within the vision budgets.
+
+    source is 'embedded' (first-block image sent unchanged), 'reencoded'
+    (oversized embedded image) or 'render' (page rasterised).
+    """
+    blocks = page.get_text('dict').get('blocks', [])
+    if blocks and blocks[0].get('type') == 1:
+        block = blocks[0]
+        if (block.get('ext') in ('jpeg', 'jpg')
+                and len(block['image']) <= app.config['VISION_MAX_IMAGE_BYTES']
+                and block['width'] * block['height'] <= app.config['VISION_MAX_PIXELS']):
+            return block['image'], 'embedded'
+        return encode_vision_image(fitz.Pixmap(block['image'])), 'reencoded'
+
+    # Render at the scale that fills the pixel budget (at most 2x)
+    rect = page.rect
+    zoom = min(2.0, (app.config['VISION_MAX_PIXELS'] / max(1.0, rect.width * rect.height)) ** 0.5)
+    colorspace = fitz.csGRAY if app.config['VISION_GRAYSCALE'] else fitz.csRGB
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+    return encode_vision_image(pix), 'render'
+
+def is_image_based_pdf(pages):
+    """Return True if PDF pages contain images only (no text layer)"""
+    return not any(p['text'].strip() for p in pages)
+
+def get_page_images_b64(pages):
+    """Base64 JPEG for each scanned page"""
+    return [base64.b64encode(p['image']).decode() for p in pages if p['image'] is not None]
+
+def page_image_report(pages):
+    """Bytes that go to vision for each scanned page, and where the image came from"""
+    return [{'page': p['number'], 'bytes': len(p['image']), 'source': p['image_source']}
+            for p in pages if p['image'] is not None]
 
 # ─────────────────────────────────────────────
 # VISION-BASED EXTRACTION (Claude API)
@@ -153,131 +779,696 @@ Numbers use period as decimal separator. Ignore "Saldo Oorgedra" (opening balanc
 Example output:
 [{"date":"05/11/2025","description":"Digitale Betaal Dt Vereffenin Absa Bank Pr Markram Musi","amount":-920.00},{"date":"07/11/2025","description":"Digitale Betaal Kt Vereffenin Absa Bank Uys & Partners Huur","amount":37443.45}]"""
 
-def extract_via_vision(pdf_path):
-    """Use Claude vision API to extract transactions from image-based PDFs"""
-    images_b64 = get_page_images_b64(pdf_path)
-    all_transactions = []
-
-    for img_b64 in images_b64:
-        content = [
-            {
-                "type": "image",
-                "source": {"type": "base64", "media_type": "image/jpeg", "data": img_b64}
-            },
-            {
-                "type": "text",
-                "text": "Extract all transaction rows from this bank statement page. Return JSON array only."
-            }
-        ]
+VISION_MODEL = 'claude-sonnet-4-20250514'
+VISION_USER_PROMPT = "Extract all transaction rows from this bank statement page. Return JSON array only."
+VISION_BATCH_PROMPT = ("These are {count} consecutive pages of one bank statement, each image preceded by its "
+                       "page label. Extract all transaction rows from every page. Return one JSON array only, "
+                       "and give every row a \"page\" field with the number from its page label, e.g. "
+                       "{{\"page\":{first},\"date\":\"05/11/2025\",\"description\":\"...\",\"amount\":-920.00}}.")
+VISION_MAX_TOKENS = 4000  # per page
+VISION_BATCH_MAX_TOKENS = 16000
+
+# Responses worth retrying: rate limited, overloaded or a transient server error
+VISION_RETRY_STATUSES = {408, 429, 500, 502, 503, 504, 529}
+
+class VisionAPIError(Exception):
+    """Non-2xx response from the messages API"""
+
+    def __init__(self, status, body, retry_after=None):
+        super().__init__(f"HTTP {status} error: {body}")
+        self.status = status
+        self.body = body
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Client-side rate limiter: rate tokens per second, at most burst saved up"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        """Wait for a token; False if it would not arrive before deadline (monotonic)"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    return False
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def hold(self, seconds):
+        """Hand out no token for the next seconds (after a 429), whatever was saved up"""
+        with self._lock:
+            # Credit the time since the last acquire first, or the next acquire would and undo the hold
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens = min(self._tokens, 1.0) - seconds * self.rate
+
+class VisionClient:
+    """Messages API client shared by every vision request in this process.
+
+    Keeps up to max_idle keep-alive connections to the API host and reuses
+    them across pages and documents. Each request first takes a token from
+    the bucket (rate_per_minute, burst), so concurrent conversions share one
+    request budget. 429, 5xx and 529 responses and connection errors are
+    retried up to max_retries times with jittered exponential backoff; a
+    Retry-After header sets the wait instead, and a 429 also holds back the
+    other threads. No attempt starts after deadline (time.monotonic()).
+    """
+
+    def __init__(self, url, rate_per_minute, burst, max_retries, backoff_base, backoff_max, timeout, max_idle=4):
+        self.settings = (url, rate_per_minute, burst, max_retries, backoff_base, backoff_max, timeout, max_idle)
+        parts = urllib.parse.urlsplit(url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path + (f'?{parts.query}' if parts.query else '')
+        self.bucket = TokenBucket(rate_per_minute / 60, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        """(connection, reused) — an idle keep-alive connection if there is one"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _finish(self, conn, resp):
+        """Keep a connection whose response has been read in full, unless the server closes it.
+
+        Reading lines up to Content-Length does not close an HTTPResponse,
+        and http.client refuses the next request on its connection until
+        it is, so whatever is left is read (which closes it) first.
+        """
+        if not resp.isclosed():
+            resp.read()
+        if resp.will_close or not resp.isclosed():
+            conn.close()
+        else:
+            self._release(conn)
 
-        payload = json.dumps({
-            "model": "claude-sonnet-4-20250514",
-            "max_tokens": 4000,
-            "system": VISION_SYSTEM_PROMPT,
-            "messages": [{"role": "user", "content": content}]
-        }).encode()
+    def _send(self, body, headers, stream=False):
+        """One request; returns (connection, response, body bytes).
 
-        api_key = os.environ.get('ANTHROPIC_API_KEY', '')
-        if not api_key:
-            raise ValueError("ANTHROPIC_API_KEY environment variable is not set. Add it in Vercel project settings.")
-
-        req = urllib.request.Request(
-            'https://api.anthropic.com/v1/messages',
-            data=payload,
-            headers={
-                'Content-Type': 'application/json',
-                'anthropic-version': '2023-06-01',
-                'x-api-key': api_key
-            }
-        )
+        With stream=True a 2xx body is left unread and the connection is
+        returned with it; otherwise the body is read, the connection goes
+        back to the idle pool and None is returned in its place.
+        """
+        conn, reused = self._connection()
+        try:
+            conn.request('POST', self.path, body=body, headers=headers)
+            resp = conn.getresponse()
+            if stream and 200 <= resp.status < 300:
+                return conn, resp, None
+            data = resp.read()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            conn.close()
+            if not reused:
+                raise
+            # The server dropped an idle keep-alive connection; retry on a fresh one
+            return self._send(body, headers, stream)
+        except Exception:
+            conn.close()
+            raise
+        self._finish(conn, resp)
+        return None, resp, data
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff for the given retry number (1-based)"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def post(self, payload, api_key, deadline=None):
+        """POST a messages API payload and return the decoded JSON response"""
+        _, _, data = self._request(payload, api_key, deadline)
+        return json.loads(data)
+
+    def stream(self, payload, api_key, deadline=None):
+        """POST a payload with "stream": true, yielding (event, data) as server-sent events arrive.
+
+        Only opening the request is retried; an error mid-stream is raised
+        to the caller, which has already seen the events before it. A server
+        that answers with plain JSON instead (a mock, say) is replayed as
+        the equivalent events.
+        """
+        conn, resp, _ = self._request(dict(payload, stream=True), api_key, deadline, stream=True)
+        complete = False
+        try:
+            if not resp.headers.get('content-type', '').startswith('text/event-stream'):
+                result = json.loads(resp.read())
+                complete = True
+                yield from _message_events(result)
+                return
+            event, data = None, []
+            for raw in resp:
+                line = raw.decode('utf-8').rstrip('\r\n')
+                if line:
+                    field, _, value = line.partition(':')
+                    if field == 'event':
+                        event = value.strip()
+                    elif field == 'data':
+                        data.append(value[1:] if value.startswith(' ') else value)
+                elif data:
+                    yield event, json.loads('\n'.join(data))
+                    event, data = None, []
+            complete = True
+        finally:
+            if complete:
+                self._finish(conn, resp)
+            else:
+                conn.close()
+
+    def _request(self, payload, api_key, deadline=None, stream=False):
+        """Send with rate limiting and retries; returns _send's result for the first 2xx response"""
+        body = json.dumps(payload).encode()
+        headers = {
+            'Content-Type': 'application/json',
+            'anthropic-version': '2023-06-01',
+            'x-api-key': api_key,
+        }
+        attempt = 0
+        while True:
+            # Threads still running after the caller gave up must not start paid requests
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError("vision deadline reached")
+            if not self.bucket.acquire(deadline):
+                raise TimeoutError("deadline reached waiting for the vision rate limit")
+            try:
+                conn, resp, data = self._send(body, headers, stream)
+                if 200 <= resp.status < 300:
+                    return conn, resp, data
+                error = VisionAPIError(resp.status, data.decode(errors='replace'),
+                                       parse_retry_after(resp.headers.get('retry-after')))
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+            retryable = not isinstance(error, VisionAPIError) or error.status in VISION_RETRY_STATUSES
+            attempt += 1
+            if not retryable or attempt > self.max_retries:
+                raise error
+            wait = getattr(error, 'retry_after', None)
+            if wait is None:
+                wait = self._backoff(attempt)
+            if getattr(error, 'status', None) == 429:
+                self.bucket.hold(wait)
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise error
+            print(f"[VISION] {_vision_error_message(error)[:120]} — retry {attempt}/{self.max_retries} in {wait:.1f}s",
+                  file=sys.stderr)
+            time.sleep(wait)
+
+def _message_events(result):
+    """Streaming events equivalent to a complete (non-streamed) messages API response"""
+    if 'error' in result:
+        yield 'error', result
+        return
+    usage = result.get('usage') or {}
+    yield 'message_start', {'message': {'usage': {'input_tokens': usage.get('input_tokens', 0)}}}
+    for block in result.get('content', []):
+        if block.get('type') == 'text':
+            yield 'content_block_delta', {'delta': {'type': 'text_delta', 'text': block['text']}}
+    yield 'message_delta', {'delta': {'stop_reason': result.get('stop_reason', 'end_turn')},
+                            'usage': {'output_tokens': usage.get('output_tokens', 0)}}
+    yield 'message_stop', {}
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delay-seconds or HTTP-date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+_vision_client = None
+_vision_client_lock = threading.Lock()
+
+def get_vision_client():
+    """Shared VisionClient for the current VISION_* settings (rebuilt if they change)"""
+    global _vision_client
+    settings = (
+        app.config['VISION_API_URL'],
+        app.config['VISION_RATE_LIMIT'],
+        app.config['VISION_BURST'],
+        app.config['VISION_MAX_RETRIES'],
+        app.config['VISION_BACKOFF_BASE'],
+        app.config['VISION_BACKOFF_MAX'],
+        app.config['VISION_REQUEST_TIMEOUT'],
+        max(1, app.config['VISION_MAX_WORKERS']),
+    )
+    with _vision_client_lock:
+        if _vision_client is None or _vision_client.settings != settings:
+            _vision_client = VisionClient(*settings)
+        return _vision_client
+
+def vision_page_payload(img_b64):
+    """Messages API payload for a single page image"""
+    content = [
+        {
+            "type": "image",
+            "source": {"type": "base64", "media_type": "image/jpeg", "data": img_b64}
+        },
+        {
+            "type": "text",
+            "text": VISION_USER_PROMPT
+        }
+    ]
+    return {
+        "model": VISION_MODEL,
+        "max_tokens": VISION_MAX_TOKENS,
+        "system": VISION_SYSTEM_PROMPT,
+        "messages": [{"role": "user", "content": content}]
+    }
+
+def vision_batch_payload(group):
+    """Messages API payload for consecutive scanned pages, each labelled 'Page n' (1-based)"""
+    content = []
+    for page in group:
+        content.append({"type": "text", "text": f"Page {page['number'] + 1}:"})
+        content.append({
+            "type": "image",
+            "source": {"type": "base64", "media_type": "image/jpeg",
+                       "data": base64.b64encode(page['image']).decode()}
+        })
+    content.append({
+        "type": "text",
+        "text": VISION_BATCH_PROMPT.format(count=len(group), first=group[0]['number'] + 1)
+    })
+    return {
+        "model": VISION_MODEL,
+        "max_tokens": min(VISION_BATCH_MAX_TOKENS, VISION_MAX_TOKENS * len(group)),
+        "system": VISION_SYSTEM_PROMPT,
+        "messages": [{"role": "user", "content": content}]
+    }
 
+def vision_page_groups(pages, max_pages, max_bytes):
+    """Split scanned pages into runs of consecutive pages, one request each.
+
+    A run holds at most max_pages images and max_bytes of image data; a
+    page over max_bytes on its own still gets a request of its own.
+    """
+    groups = []
+    size = 0
+    for page in pages:
+        group = groups[-1] if groups else None
+        if (group and len(group) < max_pages and group[-1]['number'] + 1 == page['number']
+                and size + len(page['image']) <= max_bytes):
+            group.append(page)
+            size += len(page['image'])
+        else:
+            groups.append([page])
+            size = len(page['image'])
+    return groups
+
+class JsonArrayStream:
+    """Incremental parser for a JSON array of objects that arrives in pieces.
+
+    feed(text) returns the elements completed by that piece, so rows are
+    available before the response ends. Text before the opening '[' (such
+    as a ```json fence) and after the closing ']' is ignored; done is set
+    once the array closes. in_array=True starts inside an array already
+    opened, for the continuation of a truncated response.
+    """
+
+    def __init__(self, in_array=False):
+        self.in_array = in_array
+        self.done = False
+        self._depth = 1 if in_array else 0
+        self._in_string = False
+        self._escape = False
+        self._element = []  # pieces of an element split across feeds
+
+    def feed(self, text):
+        rows = []
+        if self.done:
+            return rows
+        start = 0 if self._element else None
+        for i, ch in enumerate(text):
+            if not self.in_array:
+                if ch == '[':
+                    self.in_array, self._depth = True, 1
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                if self._depth == 1:
+                    start = i
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self.done = True
+                    break
+                if self._depth == 1 and start is not None:
+                    self._element.append(text[start:i + 1])
+                    element = ''.join(self._element)
+                    self._element, start = [], None
+                    try:
+                        rows.append(json.loads(element))
+                    except json.JSONDecodeError as e:
+                        raise ValueError(f"JSON parse error: {e} — element was: {element[:200]}")
+        if start is not None:
+            self._element.append(text[start:])
+        return rows
+
+def vision_stream_rows(payload, api_key, deadline=None, usage=None):
+    """Rows from a streamed messages API request; returns (rows, truncated).
+
+    Rows are parsed as the text arrives. If the response stops before the
+    array closes (max_tokens, a dropped stream or an error event), the rows
+    so far are kept and a follow-up request prefills the assistant turn
+    with them, so the model writes only the remaining rows. After
+    VISION_MAX_CONTINUATIONS follow-ups, truncated is a short reason and
+    rows are whatever was read; otherwise it is None. Raises if the first
+    request fails before any row arrives.
+    """
+    rows = []
+    reason = None
+    client = get_vision_client()
+    for attempt in range(max(0, app.config['VISION_MAX_CONTINUATIONS']) + 1):
+        request = payload
+        parser = JsonArrayStream(in_array=attempt > 0)
+        if attempt:
+            prefill = '[' + ''.join(json.dumps(row) + ',' for row in rows)
+            request = dict(payload, messages=payload['messages'] + [{'role': 'assistant', 'content': prefill}])
+            print(f"[VISION] Response truncated ({reason}) after {len(rows)} rows, requesting the rest",
+                  file=sys.stderr)
+        stop_reason = None
         try:
-            with urllib.request.urlopen(req, timeout=90) as resp:
-                raw = resp.read()
-                result = json.loads(raw)
-                print(f"[VISION] API response keys: {list(result.keys())}", file=sys.stderr)
-                if 'error' in result:
-                    print(f"[VISION] API error: {result['error']}", file=sys.stderr)
-                    continue
-                text = result['content'][0]['text'].strip()
-                print(f"[VISION] Raw text ({len(text)} chars): {text[:300]}", file=sys.stderr)
-                # Strip any markdown fences if present
-                text = re.sub(r'^```(?:json)?\s*', '', text)
-                text = re.sub(r'\s*```$', '', text)
-                rows = json.loads(text)
-                print(f"[VISION] Parsed {len(rows)} rows", file=sys.stderr)
-                all_transactions.extend(rows)
-        except urllib.error.HTTPError as e:
-            body = e.read().decode()
-            print(f"[VISION] HTTP {e.code} error: {body}", file=sys.stderr)
-            continue
-        except urllib.error.URLError as e:
-            print(f"[VISION] URL error: {e.reason}", file=sys.stderr)
-            continue
-        except json.JSONDecodeError as e:
-            print(f"[VISION] JSON parse error: {e} — text was: {text[:200]}", file=sys.stderr)
-            continue
-        except Exception as e:
-            import traceback
-            print(f"[VISION] Unexpected error: {traceback.format_exc()}", file=sys.stderr)
+            for event, data in client.stream(request, api_key, deadline):
+                if event == 'message_start':
+                    if usage is not None:
+                        usage['requests'] += 1
+                        usage['input_tokens'] += data['message'].get('usage', {}).get('input_tokens', 0)
+                elif event == 'content_block_delta' and data['delta'].get('type') == 'text_delta':
+                    rows.extend(parser.feed(data['delta']['text']))
+                elif event == 'message_delta':
+                    stop_reason = data['delta'].get('stop_reason')
+                    if usage is not None:
+                        usage['output_tokens'] += data.get('usage', {}).get('output_tokens', 0)
+                elif event == 'error':
+                    raise ConnectionError(f"stream error: {data.get('error')}")
+        except (OSError, http.client.HTTPException) as e:
+            if attempt == 0 and not rows and not parser.in_array:
+                raise
+            reason = _vision_error_message(e)
+            if attempt and isinstance(e, VisionAPIError):
+                break  # the follow-up itself was refused
+            if deadline is not None and time.monotonic() >= deadline:
+                break
             continue
-
-    # Convert to standard internal format: (date_str, description, amount_float)
+        if parser.done:
+            print(f"[VISION] Parsed {len(rows)} rows", file=sys.stderr)
+            return rows, None
+        reason = f"stopped at {stop_reason}" if stop_reason else "stream ended early"
+    print(f"[VISION] Response still truncated ({reason}), keeping {len(rows)} rows", file=sys.stderr)
+    return rows, reason
+
+def _split_rows_by_page(rows, group):
+    """{page_no: rows} from a batch response, or None if a row's page tag is missing or unknown"""
+    numbers = {page['number'] + 1: page['number'] for page in group}
+    by_page = {page['number']: [] for page in group}
+    for row in rows:
+        try:
+            page_no = numbers[int(row.pop('page'))]
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+        by_page[page_no].append(row)
+    return by_page
+
+def vision_extract_pages(group, api_key, deadline=None):
+    """Read a run of consecutive scanned pages; returns ({page_no: rows}, usage, incomplete, batched).
+
+    More than one page goes in a single request and the page-tagged rows
+    are split back per page. If any row comes back without a valid page
+    tag, the run is re-read one page per request rather than guessing.
+    usage counts requests and input/output tokens for the whole run.
+    incomplete maps pages whose response stayed truncated (see
+    vision_stream_rows) to the reason; their rows are what was read. In a
+    batch, pages from the last one with rows onwards count as incomplete.
+    Raises on any other failure (after the client's retries); the caller
+    turns that into an error for every page in the run. batched is True
+    if the rows came from one batched request, False if pages were read
+    one per request.
+    """
+    usage = {'requests': 0, 'input_tokens': 0, 'output_tokens': 0}
+    incomplete = {}
+
+    def send(payload, stage):
+        with metrics.timer(stage):
+            return vision_stream_rows(payload, api_key, deadline, usage)
+
+    if len(group) > 1:
+        rows, truncated = send(vision_batch_payload(group), 'vision_batch')
+        by_page = _split_rows_by_page(rows, group)
+        if by_page is not None:
+            if truncated:
+                last = max((n for n, page_rows in by_page.items() if page_rows), default=group[0]['number'])
+                incomplete = {n: truncated for n in by_page if n >= last}
+            return by_page, usage, incomplete, True
+        print(f"[VISION] Pages {[p['number'] for p in group]}: rows without a page tag, "
+              f"re-reading one page per request", file=sys.stderr)
+    by_page = {}
+    for page in group:
+        rows, truncated = send(vision_page_payload(base64.b64encode(page['image']).decode()), 'vision_page')
+        by_page[page['number']] = rows
+        if truncated:
+            incomplete[page['number']] = truncated
+    return by_page, usage, incomplete, False
+
+def _vision_error_message(e):
+    """Short description of a failed page request"""
+    if isinstance(e, VisionAPIError):
+        return str(e)
+    if isinstance(e, (OSError, http.client.HTTPException)) and not isinstance(e, TimeoutError):
+        return f"Connection error: {e}"
+    return f"{type(e).__name__}: {e}"
+
+def _vision_rows_to_transactions(rows):
+    """Convert parsed vision rows to (date_str, description, amount_float)"""
     transactions = []
-    for row in all_transactions:
+    for row in rows:
         try:
             date_str = row.get('date', '').strip()
             description = row.get('description', '').strip()
             amount = float(row.get('amount', 0))
             if date_str and description:
                 transactions.append((date_str, description, amount))
-        except (ValueError, TypeError):
+        except (ValueError, TypeError, AttributeError):
             continue
+    return transactions
 
+def vision_transactions_by_page(pages, page_errors=None, on_page=None, usage=None):
+    """Run the vision API over every scanned page, returning {page: transactions}.
+
+    Requests are sent concurrently through a bounded thread pool
+    (VISION_MAX_WORKERS in flight, VISION_REQUEST_TIMEOUT per request,
+    VISION_DEADLINE for the whole document). With VISION_PAGES_PER_REQUEST
+    above 1, consecutive pages share a request up to that many images and
+    VISION_BATCH_MAX_BYTES (see vision_extract_pages). Pages that fail or
+    miss the deadline are appended to page_errors as {'page': n, 'error':
+    msg} instead of being skipped silently; so are pages whose response
+    stayed truncated, whose rows so far are still returned. on_page(page_no, transactions)
+    is called as each page finishes (with [] for failed pages). Requests
+    and usage tokens are added to the usage dict, when given.
+    """
+    scanned = [p for p in pages if p['image'] is not None]
+    if page_errors is None:
+        page_errors = []
+    if on_page is None:
+        on_page = lambda page_no, transactions: None
+    result = {}
+    failed = []
+
+    # Pages already read with the same image, model and prompt are free; a
+    # batched read of the page counts only while batching is on
+    batching = app.config['VISION_PAGES_PER_REQUEST'] > 1
+    misses = []
+    for page in scanned:
+        rows = vision_cache.get(vision_cache_key(page['image']))
+        if rows is None and batching:
+            rows = vision_cache.get(vision_cache_key(page['image'], batched=True))
+        if rows is None:
+            misses.append(page)
+        else:
+            result[page['number']] = _vision_rows_to_transactions(rows)
+            on_page(page['number'], result[page['number']])
+    print(f"[VISION] {len(scanned) - len(misses)} of {len(scanned)} pages served from cache", file=sys.stderr)
+    for page in misses:
+        print(f"[VISION] Page {page['number']}: sending {len(page['image'])} bytes ({page['image_source']})",
+              file=sys.stderr)
+
+    api_key = os.environ.get('ANTHROPIC_API_KEY', '')
+    if misses and not api_key:
+        raise ValueError("ANTHROPIC_API_KEY environment variable is not set. Add it in Vercel project settings.")
+
+    images = {page['number']: page['image'] for page in misses}
+    groups = vision_page_groups(misses, max(1, app.config['VISION_PAGES_PER_REQUEST']),
+                                app.config['VISION_BATCH_MAX_BYTES'])
+    totals = {'requests': 0, 'input_tokens': 0, 'output_tokens': 0}
+    deadline = time.monotonic() + app.config['VISION_DEADLINE']
+    pool = ThreadPoolExecutor(max_workers=max(1, app.config['VISION_MAX_WORKERS']))
+    try:
+        futures = {
+            pool.submit(vision_extract_pages, group, api_key, deadline): [p['number'] for p in group]
+            for group in groups
+        }
+        pending = set(futures)
+        try:
+            for future in as_completed(futures, timeout=app.config['VISION_DEADLINE']):
+                pending.discard(future)
+                page_numbers = futures[future]
+                try:
+                    rows_by_page, spent, incomplete, batched = future.result()
+                except Exception as e:
+                    message = _vision_error_message(e)
+                    for page_no in page_numbers:
+                        print(f"[VISION] Page {page_no} failed: {message}", file=sys.stderr)
+                        failed.append({'page': page_no, 'error': message})
+                        on_page(page_no, [])
+                    continue
+                for name, value in spent.items():
+                    totals[name] += value
+                for page_no in page_numbers:
+                    rows = rows_by_page[page_no]
+                    if page_no in incomplete:
+                        # Partial rows are kept but neither cached nor passed off as the whole page
+                        message = f"incomplete response ({incomplete[page_no]}), {len(rows)} rows kept"
+                        print(f"[VISION] Page {page_no}: {message}", file=sys.stderr)
+                        failed.append({'page': page_no, 'error': message})
+                    else:
+                        vision_cache.put(vision_cache_key(images[page_no], batched), rows)
+                    result[page_no] = _vision_rows_to_transactions(rows)
+                    on_page(page_no, result[page_no])
+        except FuturesTimeoutError:
+            for future in pending:
+                for page_no in futures[future]:
+                    print(f"[VISION] Page {page_no} missed the deadline", file=sys.stderr)
+                    failed.append({'page': page_no, 'error': 'deadline exceeded'})
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    if misses:
+        print(f"[VISION] {len(misses)} pages in {totals['requests']} requests: {totals['input_tokens']} input, "
+              f"{totals['output_tokens']} output tokens", file=sys.stderr)
+    metrics.inc('vision_requests_total', (), totals['requests'])
+    metrics.inc('vision_tokens_total', (('type', 'input'),), totals['input_tokens'])
+    metrics.inc('vision_tokens_total', (('type', 'output'),), totals['output_tokens'])
+    if usage is not None:
+        for name, value in totals.items():
+            usage[name] = usage.get(name, 0) + value
+    page_errors.extend(sorted(failed, key=lambda e: e['page']))
+    return result
+
+def extract_via_vision(pages, page_errors=None):
+    """Use Claude vision API to extract transactions from image-based PDF pages"""
+    by_page = vision_transactions_by_page(pages, page_errors)
+    transactions = []
+    for page in pages:
+        transactions.extend(by_page.get(page['number'], []))
     return transactions
 
 # ─────────────────────────────────────────────
 # TEXT-BASED EXTRACTION (FNB, Standard Bank, old ABSA)
 # ─────────────────────────────────────────────
 
-def detect_bank(text):
-    """Detect bank from PDF text"""
-    text_lower = text.lower()
-    if 'absa' in text_lower or 'tjekrekeningstaat' in text_lower:
-        return 'ABSA'
-    elif 'standard bank' in text_lower or 'standardbank' in text_lower:
-        return 'STANDARD'
-    elif 'fnb' in text_lower or 'first national bank' in text_lower:
-        return 'FNB'
-    return 'FNB'
-
-def extract_fnb_transactions(text):
-    """Extract transactions from FNB bank statement text"""
-    transactions = []
-    lines = text.split('\n')
-    date_pattern = re.compile(r'^\d{1,2}\s+\w+\s+\d{2,4}')
-    amount_pattern = re.compile(r'[-+]?\d{1,3}(?:,\d{3})*\.\d{2}')
+def iter_transactions(parser, lines, flush=True):
+    """Feed a line parser and yield transactions as they complete.
 
+    With flush=False an open block stays in the parser, so the next page's
+    lines can be fed to the same parser.
+    """
     for line in lines:
+        transaction = parser.feed(line)
+        if transaction is not None:
+            yield transaction
+    if not flush:
+        return
+    transaction = parser.flush()
+    if transaction is not None:
+        yield transaction
+
+# Line parsers share one interface: feed(line) returns a transaction tuple or
+# None, flush() returns whatever is still pending at the end of the input,
+# and save_state()/restore(state) carry an unfinished parse between chunks.
+
+AMOUNT_RE = re.compile(r'[-+]?\d{1,3}(?:,\d{3})*\.\d{2}')
+FNB_DATE_RE = re.compile(r'^\d{1,2}\s+\w+\s+\d{2,4}')
+STANDARD_BANK_DATE_RE = re.compile(r'^\d{2}\s+\w{3}\s+\d{2}')
+
+class DatedLineParser:
+    """One transaction per line: leading date, description, first amount (FNB, Standard Bank)"""
+
+    def __init__(self, date_pattern):
+        self.date_pattern = date_pattern
+
+    def feed(self, line):
         line = line.strip()
         if not line:
-            continue
-        date_match = date_pattern.match(line)
-        if date_match:
-            amounts = amount_pattern.findall(line)
-            if amounts:
-                date_str = parse_fnb_date(date_match.group())
-                description_start = date_match.end()
-                description = line[description_start:].strip()
-                for amt in amounts:
-                    description = description.replace(amt, '').strip()
-                amount_str = amounts[0].replace(',', '')
-                try:
-                    amount = float(amount_str)
-                    transactions.append((date_str, description, amount))
-                except ValueError:
-                    pass
-    return transactions
+            return None
+        date_match = self.date_pattern.match(line)
+        if not date_match:
+            return None
+        amounts = AMOUNT_RE.findall(line)
+        if not amounts:
+            return None
+        date_str = parse_fnb_date(date_match.group())
+        description_start = date_match.end()
+        description = line[description_start:].strip()
+        for amt in amounts:
+            description = description.replace(amt, '').strip()
+        amount_str = amounts[0].replace(',', '')
+        try:
+            return (date_str, description, float(amount_str))
+        except ValueError:
+            return None
+
+    def flush(self):
+        return None
+
+    def save_state(self):
+        return {}
+
+    def restore(self, state):
+        pass
+
+def extract_fnb_transactions(text):
+    """Extract transactions from FNB bank statement text"""
+    return list(iter_transactions(DatedLineParser(FNB_DATE_RE), text.split('\n')))
 
 def parse_fnb_date(date_str):
     """Parse FNB date format like '30 Oct 25' or '30 Oct 2025'"""
@@ -301,274 +1492,1344 @@ def parse_amount(s):
     """Convert SA format '5 608.59' to float 5608.59"""
     return float(s.replace(' ', ''))
 
+ABSA_DATE_RE = re.compile(r'^\d{1,2}/\d{1,2}/\d{4}$')
+# Lines that close an open date block: next date, section header, fee/interest summary
+ABSA_BLOCK_END_RE = re.compile(r'\d{1,2}/\d{1,2}/\d{4}$|DIENSGELD|KREDIETRENTE|.*U transaksies')
+ABSA_CONTAINS_SKIP = [
+    'DIENSGELD', 'KREDIETRENTE', 'ABSA BESIG', 'KOSTE :', 'BTW R',
+    'Bladsy ', 'Tjekreken', 'Registrasie', 'Gemagtigde', 'Absa Bank Beperk',
+    'CSP002', 'JFBK', 'BTW-reg', 'Stuur terug', 'Privaatsak',
+    'JURISFORUM', 'POSBUS', 'VRYHEID', 'Privaatheidskennisgewing',
+    'BESOEK', 'KONTAK', 'www.', 'http', 'Ons Privaat',
+]
+
+# Block lines are classified ('amount', 'fee', 'type', 'skip' or 'desc') with
+# one dict lookup for whole-line tokens and at most one regex search: amount,
+# account number (e.g. "10-0380-1108") or any of the contains-skip
+# substrings. Everything else is description.
+ABSA_LINE_CLASSES = {'*': 'fee'}  # * marker = bank fee
+ABSA_LINE_CLASSES[''] = 'skip'  # blank lines; replaces the old `if not bl: continue`
+ABSA_LINE_CLASSES.update(dict.fromkeys(['T', 'A', 'D', 'G', 'K'], 'type'))
+ABSA_LINE_CLASSES.update(dict.fromkeys([
+    'Saldo Oorgedra', 'Saldo oorgedra', 'Diverse Krediete', 'Diverse Debiete',
+    'Oortrekkingslimiet', 'Rekeningopsomming', 'U transaksies', 'Datum',
+    'Transaksiebeskrywing', 'Debietbedrag', 'Kredietbedrag', 'Koste', 'Saldo',
+    'Belastingfaktuur', 'Tjekrekeningstaat', 'Rekeningtipe:', 'Uitgereik op:',
+    'Staatnr:', 'Groeiende Besig Rek',
+], 'skip'))
+ABSA_LINE_RE = re.compile(
+    r'(?P<amount>^\d{1,3}(?:\s\d{3})*\.\d{2}$)'
+    r'|(?P<skip>^\d{2}-\d{4}-\d{4}$|' + _trie_pattern(ABSA_CONTAINS_SKIP) + ')'
+)
+
+# Sign keywords are found in one pass over the lowercased description. The
+# pattern is a lookahead, so the keyword starting at every position is seen
+# even where matches overlap ('mndelikrediet' holds 'mndelik' and 'krediet',
+# 'acb krediet' holds 'krediet'); no keyword is a prefix of another.
+ABSA_SIGN_KEYWORDS = [
+    'betaal dt', 'betaal kt', 'betaal bewys', 'acb krediet', 'acb debiet',
+    'krediet', 'debiet', 'deposito', 'fooi', 'koste', 'admin', 'mndelik',
+]
+ABSA_SIGN_KEYWORD_RE = re.compile('(?=(' + _trie_pattern(ABSA_SIGN_KEYWORDS) + '))')
+
+# (keywords, sign) rules tried in order, then the default sign
+ABSA_SIGN_RULES = {
+    # Type code + koste + amount + balance
+    'type_coded': ([({'betaal dt', 'debiet', 'betaal bewys'}, -1),
+                    ({'betaal kt', 'krediet'}, 1)], -1),  # default debit for unknown type-coded rows
+    # Amount + balance, no type code
+    'plain': ([({'betaal kt', 'acb krediet', 'deposito'}, 1),
+               ({'betaal dt', 'acb debiet', 'debiet'}, -1)], 1),  # default positive if unknown
+    # Anything else with 2+ amounts
+    'fallback': ([({'betaal dt', 'debiet', 'fooi', 'koste', 'admin', 'mndelik'}, -1)], 1),
+}
+
+def absa_sign_keywords(description):
+    """Set of ABSA_SIGN_KEYWORDS occurring in description (case-insensitive)"""
+    return set(ABSA_SIGN_KEYWORD_RE.findall(description.lower()))
+
+def absa_sign(keywords, rule):
+    """+1 or -1 for a block's sign keywords under one of ABSA_SIGN_RULES"""
+    rules, default = ABSA_SIGN_RULES[rule]
+    for rule_keywords, sign in rules:
+        if keywords & rule_keywords:
+            return sign
+    return default
+
+class AbsaStatementParser:
+    """Block state machine for ABSA Tjekrekeningstaat text — line-per-field format.
+
+    Lines before the first 'U transaksies' header are ignored. Each date line
+    opens a block that collects the following lines until the next date, a
+    'U transaksies' header or a DIENSGELD/KREDIETRENTE line. The open block
+    is carried across page boundaries and emitted when it closes.
+    """
+
+    def __init__(self):
+        self.in_section = False
+        self.date_str = None  # date of the open block, None between blocks
+        self.block = []
+
+    def feed(self, line):
+        line = line.strip()
+        if not self.in_section:
+            # Skip to transaction section
+            if 'U transaksies' in line:
+                self.in_section = True
+            return None
+
+        transaction = None
+        if self.date_str is not None:
+            if not ABSA_BLOCK_END_RE.match(line):
+                self.block.append(line)
+                return None
+            transaction = self.flush()
+
+        if 'U transaksies (vervolg)' in line:
+            return transaction
+        if ABSA_DATE_RE.match(line):
+            parts = line.split('/')
+            self.date_str = f"{parts[0].zfill(2)}/{parts[1].zfill(2)}/{parts[2]}"
+            self.block = []
+        return transaction
+
+    def flush(self):
+        """Close the open block, returning its transaction if it has one"""
+        if self.date_str is None:
+            return None
+        date_str, block = self.date_str, self.block
+        self.date_str, self.block = None, []
+        return absa_block_transaction(date_str, block)
+
+    def save_state(self):
+        """JSON-serialisable state, including the open block, for chunk cursors"""
+        return {'in_section': self.in_section, 'date_str': self.date_str, 'block': list(self.block)}
+
+    def restore(self, state):
+        self.in_section = state['in_section']
+        self.date_str = state['date_str']
+        self.block = list(state['block'])
+
+def absa_block_transaction(date_str, block):
+    """Turn one ABSA date block into (date_str, description, amount), or None"""
+    if not block:
+        return None
+    if 'Saldo Oorgedra' in block[0] or 'Saldo oorgedra' in block[0]:
+        return None
+    if block[0] in ('Datum', 'Transaksiebeskrywing', 'Koste'):
+        return None
+
+    amounts = []
+    desc_parts = []
+    has_type_code = False
+    has_fee_marker = False
+    line_classes = ABSA_LINE_CLASSES
+    line_search = ABSA_LINE_RE.search
+    for bl in block:
+        kind = line_classes.get(bl)
+        if kind is None:
+            m = line_search(bl)
+            kind = m.lastgroup if m else 'desc'
+        if kind == 'amount':
+            amounts.append(bl)
+        elif kind == 'fee':
+            has_fee_marker = True
+        elif kind == 'type':
+            has_type_code = True
+        elif kind == 'desc':
+            desc_parts.append(bl)
+
+    if not amounts:
+        return None
+
+    if not desc_parts:
+        return None
+
+    # Full description for sign detection (before trimming)
+    full_desc = ' '.join(desc_parts)
+
+    # ── Determine transaction amount and sign ──
+    #
+    # Case 1: Fee marker (*) + 2 amounts → bank charge (debit)
+    #   e.g. Mndeliks Rek-fooi * 160.00 91742.65
+    if has_fee_marker and len(amounts) == 2:
+        return (date_str, _absa_description(desc_parts), -abs(parse_amount(amounts[-2])))
+
+    # Case 2: Type code (T/A/D/G/K) + 3 amounts → koste + txn_amount + balance
+    #   e.g. Digitale Betaal Dt T 10.00 920.00 55271.05
+    if has_type_code and len(amounts) == 3:
+        rule = 'type_coded'
+
+    # Case 3: Type code + 2 amounts → koste + balance only, no txn amount → SKIP
+    elif has_type_code and len(amounts) == 2:
+        return None
+
+    # Case 4: No type code + 2 amounts → txn_amount + balance (no koste)
+    #   e.g. Acb Krediet 5608.59 47320.21  OR  Digitale Betaal Kt 34999.15 72565.94
+    elif not has_type_code and len(amounts) == 2:
+        rule = 'plain'
+
+    # Case 5: Type code + 4 amounts → koste + ??? — fallback
+    elif len(amounts) >= 2:
+        rule = 'fallback'
+
+    else:
+        return None
+
+    sign = absa_sign(absa_sign_keywords(full_desc), rule)
+    return (date_str, _absa_description(desc_parts), sign * abs(parse_amount(amounts[-2])))
+
+def _absa_description(desc_parts):
+    """Keep only the reference line (last part) if 3+ desc parts"""
+    if len(desc_parts) >= 3:
+        return desc_parts[-1]
+    return ' '.join(desc_parts)
+
 def extract_absa_transactions_text(text):
     """Extract transactions from ABSA Tjekrekeningstaat — line-per-field format"""
-    lines = [l.strip() for l in text.split('\n')]
-
-    date_re = re.compile(r'^\d{1,2}/\d{1,2}/\d{4}$')
-    amount_re = re.compile(r'^\d{1,3}(?:\s\d{3})*\.\d{2}$')
-    type_codes = {'T', 'A', 'D', 'G', 'K', '*'}
-
-    exact_skip = {
-        'Saldo Oorgedra', 'Saldo oorgedra', 'Diverse Krediete', 'Diverse Debiete',
-        'Oortrekkingslimiet', 'Rekeningopsomming', 'U transaksies', 'Datum',
-        'Transaksiebeskrywing', 'Debietbedrag', 'Kredietbedrag', 'Koste', 'Saldo',
-        'Belastingfaktuur', 'Tjekrekeningstaat', 'Rekeningtipe:', 'Uitgereik op:',
-        'Staatnr:', 'Groeiende Besig Rek',
+    return list(iter_transactions(AbsaStatementParser(), text.split('\n')))
+
+def extract_standard_bank_transactions(text):
+    """Extract transactions from Standard Bank statement text"""
+    return list(iter_transactions(DatedLineParser(STANDARD_BANK_DATE_RE), text.split('\n')))
+
+# ── Bank parser registry ──
+#
+# Each bank registers weighted signatures (lowercase substrings), a factory
+# for its line parser and optionally its own scorer. Detection only reads
+# the first BANK_DETECT_CHARS of the text layer; the best score at or above
+# BANK_MIN_CONFIDENCE wins, ties going to the bank registered first, and
+# anything else is UNKNOWN_BANK rather than a guess.
+
+UNKNOWN_BANK = 'UNKNOWN'
+BANK_DETECT_CHARS = 8 * 1024
+BANK_MIN_CONFIDENCE = 0.5
+BANK_PARSERS = {}
+
+def signature_score(sample, signatures):
+    """Confidence in [0, 1): weights of the signatures found, combined as 1 - prod(1 - w)"""
+    miss = 1.0
+    for signature, weight in signatures.items():
+        if signature in sample:
+            miss *= 1 - weight
+    return 1 - miss
+
+def register_bank_parser(name, signatures, new_parser, scorer=None):
+    """Register a bank for detection and parsing.
+
+    signatures maps lowercase substrings to weights in (0, 1), new_parser()
+    returns a fresh line parser, and scorer(sample, signatures) -> confidence
+    replaces signature_score when given (sample is already lowercased).
+    """
+    BANK_PARSERS[name] = {
+        'signatures': signatures,
+        'new_parser': new_parser,
+        'scorer': scorer or signature_score,
     }
-    contains_skip = [
-        'DIENSGELD', 'KREDIETRENTE', 'ABSA BESIG', 'KOSTE :', 'BTW R',
-        'Bladsy ', 'Tjekreken', 'Registrasie', 'Gemagtigde', 'Absa Bank Beperk',
-        'CSP002', 'JFBK', 'BTW-reg', 'Stuur terug', 'Privaatsak',
-        'JURISFORUM', 'POSBUS', 'VRYHEID', 'Privaatheidskennisgewing',
-        'BESOEK', 'KONTAK', 'www.', 'http', 'Ons Privaat',
-    ]
-    # Account number pattern e.g. "10-0380-1108"
-    account_no_re = re.compile(r'^\d{2}-\d{4}-\d{4}$')
-    debit_keywords = ['betaal dt', 'fooi', 'transaksie koste', 'admin koste',
-                      'mndelik', 'betaal bewys']
-    credit_keywords = ['betaal kt', 'acb krediet', 'acb debiet:ekst', 'deposito']
 
-    transactions = []
-    i = 0
+register_bank_parser('ABSA', {'tjekrekeningstaat': 0.9, 'absa': 0.6, 'u transaksies': 0.5},
+                     AbsaStatementParser)
+register_bank_parser('STANDARD', {'standard bank': 0.9, 'standardbank': 0.9},
+                     lambda: DatedLineParser(STANDARD_BANK_DATE_RE))
+register_bank_parser('FNB', {'first national bank': 0.9, 'fnb': 0.6},
+                     lambda: DatedLineParser(FNB_DATE_RE))
+
+def bank_scores(text):
+    """{bank: confidence} for the start of text"""
+    sample = text[:BANK_DETECT_CHARS].lower()
+    return {name: spec['scorer'](sample, spec['signatures']) for name, spec in BANK_PARSERS.items()}
 
-    # Skip to transaction section
-    while i < len(lines):
-        if 'U transaksies' in lines[i]:
-            i += 1
+def detect_bank(text):
+    """Detect bank from the start of PDF text, or UNKNOWN_BANK"""
+    bank, best = UNKNOWN_BANK, 0.0
+    for name, score in bank_scores(text).items():
+        if score > best:
+            bank, best = name, score
+    return bank if best >= BANK_MIN_CONFIDENCE else UNKNOWN_BANK
+
+def detect_bank_pages(pages):
+    """detect_bank over the first BANK_DETECT_CHARS of the given pages' text"""
+    parts, size = [], 0
+    for page in pages:
+        if size >= BANK_DETECT_CHARS:
             break
-        i += 1
+        parts.append(page['text'][:BANK_DETECT_CHARS - size])
+        size += len(parts[-1])
+    return detect_bank(''.join(parts))
+
+
+def needs_vision(page):
+    """True for scanned pages: no usable text layer but an embedded image"""
+    return page['text_len'] < MIN_TEXT_CHARS and page['has_image']
+
+def page_route(page):
+    """'vision', 'garbled' (decoded old ABSA font) or 'text'"""
+    if needs_vision(page):
+        return 'vision'
+    return 'garbled' if page['garbled'] else 'text'
+
+def extract_transactions_from_pdf(source, invert_amounts=False, page_errors=None, progress=None, page_range=None):
+    """Main extraction function — routes each page to text parsing or vision.
+
+    Raw (un-inverted) results are cached by PDF content, so re-exports with a
+    different invert/format setting skip extraction. Scanned pages that fail
+    in the vision path are appended to page_errors; such partial results are
+    not cached. progress(pages_done, pages_total, transactions_so_far) is
+    called as pages finish (not at all on a cache hit). page_range=(start,
+    stop) converts only those pages.
+    """
+    key = result_cache_key(source, page_range)
+    transactions = result_cache.get(key)
+    if transactions is None:
+        errors = []
+        transactions = _extract_raw_transactions(source, errors, progress, page_range)
+        if not errors:
+            result_cache.put(key, tuple(transactions))
+        if page_errors is not None:
+            page_errors.extend(errors)
 
-    while i < len(lines):
-        line = lines[i]
+    if invert_amounts:
+        transactions = [(d, desc, -amt) for d, desc, amt in transactions]
+    else:
+        transactions = list(transactions)
 
-        if 'U transaksies (vervolg)' in line:
-            i += 1
-            continue
+    return transactions
 
-        if date_re.match(line):
-            parts = line.split('/')
-            date_str = f"{parts[0].zfill(2)}/{parts[1].zfill(2)}/{parts[2]}"
-            i += 1
+def _extract_raw_transactions(source, page_errors, progress=None, page_range=None):
+    """Extract transactions with bank signs as printed (no inversion)"""
+    return list(iter_raw_transactions(source, page_errors, progress, page_range))
 
-            block = []
-            while i < len(lines):
-                nl = lines[i]
-                if date_re.match(nl):
-                    break
-                if 'U transaksies' in nl or nl.startswith('DIENSGELD') or nl.startswith('KREDIETRENTE'):
-                    break
-                block.append(nl)
-                i += 1
+def route_parser(route, bank):
+    """Fresh line parser for a run of 'garbled' or 'text' pages"""
+    return AbsaStatementParser() if route == 'garbled' else BANK_PARSERS[bank]['new_parser']()
 
-            if not block:
-                continue
-            if 'Saldo Oorgedra' in block[0] or 'Saldo oorgedra' in block[0]:
-                continue
-            if block[0] in ('Datum', 'Transaksiebeskrywing', 'Koste'):
-                continue
+def iter_raw_transactions(source, page_errors, progress=None, page_range=None, cursor=None, pages=None):
+    """Iterator over raw transactions in page order, yielded as they are parsed.
 
-            amounts = []
-            desc_parts = []
-            has_type_code = False
-            has_fee_marker = False  # * marker = bank fee
-            for bl in block:
-                if not bl:
-                    continue
-                if amount_re.match(bl):
-                    amounts.append(bl)
-                elif bl == '*':
-                    has_fee_marker = True
-                elif bl in type_codes:
-                    has_type_code = True
-                elif bl in exact_skip:
-                    pass
-                elif any(cs in bl for cs in contains_skip):
-                    pass
-                elif account_no_re.match(bl):
-                    pass
-                else:
-                    desc_parts.append(bl)
+    The PDF is opened and its scanned pages read by vision before this
+    returns, so those errors surface here rather than mid-iteration. Text
+    pages are then streamed line by line into one parser per run of
+    consecutive text pages, so a block spanning a page break still parses
+    and a writer consuming the iterator starts before parsing finishes.
 
-            if not amounts:
-                continue
+    page_range=(start, stop) limits extraction to those pages. A cursor dict
+    makes this one chunk of a longer parse: the detected bank and the parser
+    left open by the previous chunk are read from it, and once the iterator
+    is exhausted the last run's parser is saved into it instead of flushed
+    (see flush_cursor). pages, when given, are source's load_pdf_pages
+    records, already loaded.
+    """
 
-            desc_parts = [p for p in desc_parts if p]
-            if not desc_parts:
+    # ── Detect PDF type ──
+    if pages is None:
+        pages = load_pdf_pages(source, page_range)
+    text_pages = [p for p in pages if page_route(p) == 'text']
+
+    print(f"[INFO] fitz extracted {sum(p['text_len'] for p in text_pages)} chars from {describe_source(source)}", file=sys.stderr)
+    if text_pages:
+        print(f"[INFO] First 200 chars: {repr(text_pages[0]['text'][:200])}", file=sys.stderr)
+    if app.config['LOG_LEVEL'] == 'debug':
+        for page in text_pages:
+            print(f"[DEBUG] FULL TEXT page {page['number']}: {repr(page['text'])}", file=sys.stderr)
+    for page in pages:
+        metrics.inc('statement_pages_total', (('route', page_route(page)),))
+    print(f"[INFO] {sum(needs_vision(p) for p in pages)} of {len(pages)} pages need vision", file=sys.stderr)
+    print(f"[INFO] {sum(p['garbled'] for p in pages)} pages decoded from the old ABSA font", file=sys.stderr)
+
+    bank = cursor.get('bank') if cursor else None
+    if bank is None:
+        with metrics.timer('bank_detect'):
+            bank = detect_bank_pages(text_pages)
+        if cursor is not None and text_pages:
+            cursor['bank'] = bank
+    print(f"[INFO] Detected bank for text pages: {bank}", file=sys.stderr)
+
+    counts = {'pages': 0, 'transactions': 0}
+    progress_lock = threading.Lock()
+
+    def page_done(pages_finished, transactions_found):
+        with progress_lock:
+            counts['pages'] += pages_finished
+            counts['transactions'] += transactions_found
+            if progress:
+                progress(counts['pages'], len(pages), counts['transactions'])
+
+    # All scanned pages share one concurrent vision run and deadline
+    vision_pages = [p for p in pages if needs_vision(p)]
+    vision_results = {}
+    if vision_pages:
+        vision_results = vision_transactions_by_page(
+            vision_pages, page_errors, on_page=lambda page_no, found: page_done(1, len(found)))
+
+    def parse_pages():
+        # Decoded pages from the old ABSA font always go to the ABSA parser.
+        # Text pages of an unrecognised format are reported, not guessed at.
+        open_route = open_parser = None
+        if cursor and cursor.get('route'):
+            open_route = cursor['route']
+            open_parser = route_parser(open_route, bank)
+            open_parser.restore(cursor['parser'])
+        for route, run in groupby(pages, key=page_route):
+            if open_parser is not None and route != open_route:
+                transaction = open_parser.flush()
+                open_route = open_parser = None
+                if transaction is not None:
+                    page_done(0, 1)
+                    yield transaction
+            if route == 'vision':
+                for page in run:
+                    yield from vision_results.get(page['number'], [])
                 continue
-
-            # Full description for sign detection (before trimming)
-            full_desc = ' '.join(desc_parts)
-            full_desc_lower = full_desc.lower()
-
-            # ── Determine transaction amount and sign ──
-            #
-            # Case 1: Fee marker (*) + 2 amounts → bank charge (debit)
-            #   e.g. Mndeliks Rek-fooi * 160.00 91742.65
-            if has_fee_marker and len(amounts) == 2:
-                txn_amount = -abs(parse_amount(amounts[-2]))
-
-            # Case 2: Type code (T/A/D/G/K) + 3 amounts → koste + txn_amount + balance
-            #   e.g. Digitale Betaal Dt T 10.00 920.00 55271.05
-            elif has_type_code and len(amounts) == 3:
-                txn_amount = parse_amount(amounts[-2])
-                # Determine sign from description
-                if any(k in full_desc_lower for k in ['betaal dt', 'debiet', 'betaal bewys']):
-                    txn_amount = -abs(txn_amount)
-                elif any(k in full_desc_lower for k in ['betaal kt', 'krediet']):
-                    txn_amount = abs(txn_amount)
-                else:
-                    txn_amount = -abs(txn_amount)  # default debit for unknown type-coded rows
-
-            # Case 3: Type code + 2 amounts → koste + balance only, no txn amount → SKIP
-            elif has_type_code and len(amounts) == 2:
+            if route == 'text' and bank == UNKNOWN_BANK:
+                for page in run:
+                    if page_errors is not None:
+                        page_errors.append({'page': page['number'], 'error': 'unrecognised bank statement format'})
+                    page_done(1, 0)
                 continue
+            if open_parser is None:
+                open_route, open_parser = route, route_parser(route, bank)
+            for page in run:
+                found = 0
+                for transaction in iter_transactions(open_parser, page['text'].split('\n'), flush=False):
+                    found += 1
+                    yield transaction
+                page_done(1, found)
+
+        if cursor is not None:
+            cursor['route'] = open_route
+            cursor['parser'] = open_parser.save_state() if open_parser is not None else None
+        elif open_parser is not None:
+            transaction = open_parser.flush()
+            if transaction is not None:
+                page_done(0, 1)
+                yield transaction
+
+    return metrics.timed_iter('parse', parse_pages())
+
+def flush_cursor(cursor):
+    """Transaction still pending in a chunk cursor's open parser, or None"""
+    if not cursor.get('route'):
+        return None
+    parser = route_parser(cursor['route'], cursor.get('bank'))
+    parser.restore(cursor['parser'])
+    return parser.flush()
 
-            # Case 4: No type code + 2 amounts → txn_amount + balance (no koste)
-            #   e.g. Acb Krediet 5608.59 47320.21  OR  Digitale Betaal Kt 34999.15 72565.94
-            elif not has_type_code and len(amounts) == 2:
-                txn_amount = parse_amount(amounts[-2])
-                if any(k in full_desc_lower for k in ['betaal kt', 'acb krediet', 'deposito']):
-                    txn_amount = abs(txn_amount)
-                elif any(k in full_desc_lower for k in ['betaal dt', 'acb debiet', 'debiet']):
-                    txn_amount = -abs(txn_amount)
-                else:
-                    txn_amount = abs(txn_amount)  # default positive if unknown
+# ─────────────────────────────────────────────
+# TRANSACTION BATCHES
+# ─────────────────────────────────────────────
 
-            # Case 5: Type code + 4 amounts → koste + ??? — fallback
-            elif len(amounts) >= 2:
-                txn_amount = parse_amount(amounts[-2])
-                if any(k in full_desc_lower for k in ['betaal dt', 'debiet', 'fooi', 'koste', 'admin', 'mndelik']):
-                    txn_amount = -abs(txn_amount)
-                else:
-                    txn_amount = abs(txn_amount)
+class TransactionColumns:
+    """Append-only column store behind TransactionBatch views.
+
+    Dates are day ordinals; a date that is not a zero-padded DD/MM/YYYY is
+    kept in the string pool and stored as -(id + 1) so it round-trips
+    unchanged. Amounts are integer cents and descriptions are ids into an
+    interned string pool, so repeated descriptions are stored once.
+    """
+
+    def __init__(self):
+        self.dates = array('l')
+        self.cents = array('q')
+        self.descriptions = array('L')
+        self.pool = []
+        self._pool_ids = {}
+        self._ordinals = {}  # date string -> stored date value
+
+    def __len__(self):
+        return len(self.cents)
+
+    def intern(self, text):
+        pool_id = self._pool_ids.get(text)
+        if pool_id is None:
+            pool_id = self._pool_ids[text] = len(self.pool)
+            self.pool.append(text)
+        return pool_id
+
+    def _date_value(self, date_str):
+        try:
+            day, month, year = (int(part) for part in date_str.split('/'))
+            if f'{day:02d}/{month:02d}/{year:04d}' == date_str:
+                return date(year, month, day).toordinal()
+        except (ValueError, AttributeError):
+            pass
+        return -(self.intern(str(date_str)) + 1)
+
+    def append(self, date_str, description, amount):
+        ordinal = self._ordinals.get(date_str)
+        if ordinal is None:
+            ordinal = self._ordinals[date_str] = self._date_value(date_str)
+        self.dates.append(ordinal)
+        self.cents.append(round(amount * 100))
+        self.descriptions.append(self.intern(description))
+
+class TransactionBatch:
+    """Read-only view over ranges of TransactionColumns, each with a sign.
+
+    Iterating yields (date_str, description, amount) tuples, so a batch
+    feeds create_excel_file / create_csv_file as-is. invert() and concat()
+    return new views over the same columns instead of copying rows.
+    """
+
+    __slots__ = ('_segments',)
+
+    def __init__(self, segments=()):
+        self._segments = tuple(segments)  # (columns, start, stop, sign)
+
+    @classmethod
+    def of(cls, columns):
+        """View over everything appended to columns so far"""
+        return cls([(columns, 0, len(columns), 1)])
+
+    @classmethod
+    def from_rows(cls, rows):
+        columns = TransactionColumns()
+        for date_str, description, amount in rows:
+            columns.append(date_str, description, amount)
+        return cls.of(columns)
+
+    @classmethod
+    def concat(cls, batches):
+        return cls(segment for batch in batches for segment in batch._segments)
+
+    def invert(self):
+        """Same rows with every amount's sign flipped"""
+        return TransactionBatch((columns, start, stop, -sign) for columns, start, stop, sign in self._segments)
+
+    def __len__(self):
+        return sum(stop - start for _, start, stop, _ in self._segments)
+
+    def __iter__(self):
+        formatted = {}
+        for columns, start, stop, sign in self._segments:
+            pool, dates, cents, descriptions = columns.pool, columns.dates, columns.cents, columns.descriptions
+            for i in range(start, stop):
+                ordinal = dates[i]
+                date_str = formatted.get(ordinal)
+                if date_str is None:
+                    if ordinal < 0:
+                        date_str = pool[-ordinal - 1]
+                    else:
+                        day = date.fromordinal(ordinal)
+                        date_str = f'{day.day:02d}/{day.month:02d}/{day.year:04d}'
+                    formatted[ordinal] = date_str
+                yield (date_str, pool[descriptions[i]], sign * cents[i] / 100)
+
+    def columns(self):
+        """(dates, descriptions, amounts) lists for columnar output.
+
+        Dates are datetime.date, or None for dates kept as text.
+        """
+        dates, descriptions, amounts = [], [], []
+        days = {}
+        for columns, start, stop, sign in self._segments:
+            for ordinal in columns.dates[start:stop]:
+                day = days.get(ordinal, days)
+                if day is days:
+                    day = days[ordinal] = date.fromordinal(ordinal) if ordinal > 0 else None
+                dates.append(day)
+            pool = columns.pool
+            descriptions.extend(pool[i] for i in columns.descriptions[start:stop])
+            amounts.extend(sign * cents / 100 for cents in columns.cents[start:stop])
+        return dates, descriptions, amounts
 
-            else:
-                continue
+# ─────────────────────────────────────────────
+# OUTPUT FILE CREATION
+# ─────────────────────────────────────────────
 
-            # Keep only the reference line (last part) if 3+ desc parts
-            if len(desc_parts) >= 3:
-                description = desc_parts[-1]
-            else:
-                description = ' '.join(desc_parts)
+EXCEL_HEADERS = ['Date', 'Description', 'Amount']
+EXCEL_COLUMN_WIDTHS = {'A': 15, 'B': 60, 'C': 15}
 
-            if not description:
-                continue
+def _excel_named_styles():
+    """Header and negative-amount styles, registered once per workbook"""
+    header = NamedStyle(name='Transactions Header')
+    header.fill = PatternFill(start_color="1F4E79", end_color="1F4E79", fill_type="solid")
+    header.font = Font(color="FFFFFF", bold=True)
+    header.alignment = Alignment(horizontal='center')
+    negative = NamedStyle(name='Negative Amount')
+    negative.font = Font(color="C00000")
+    return header, negative
 
-            transactions.append((date_str, description, txn_amount))
+def create_excel_file(transactions, output_path):
+    """Create Excel file from transactions (output_path may be a binary stream).
+
+    Uses openpyxl's write-only mode: rows are streamed from any iterable of
+    (date, description, amount) and styles are shared named styles, so
+    memory stays flat for large combined exports.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Transactions")
+    header_style, negative_style = _excel_named_styles()
+    wb.add_named_style(header_style)
+    wb.add_named_style(negative_style)
+
+    # Column widths must be set before any rows are written
+    for column, width in EXCEL_COLUMN_WIDTHS.items():
+        ws.column_dimensions[column].width = width
+
+    # Header
+    header_cells = []
+    for header in EXCEL_HEADERS:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.style = header_style.name
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    # Data — rows are serialised on append, so one styled cell is reused
+    # for every negative amount
+    negative_cell = WriteOnlyCell(ws)
+    negative_cell.style = negative_style.name
+    for date_str, description, amount in transactions:
+        if amount < 0:
+            negative_cell.value = amount
+            ws.append((date_str, description, negative_cell))
         else:
-            i += 1
+            ws.append((date_str, description, amount))
 
-    return transactions
+    wb.save(output_path)
 
-def extract_standard_bank_transactions(text):
-    """Extract transactions from Standard Bank statement text"""
-    transactions = []
-    lines = text.split('\n')
-    date_pattern = re.compile(r'^\d{2}\s+\w{3}\s+\d{2}')
-    amount_pattern = re.compile(r'[-+]?\d{1,3}(?:,\d{3})*\.\d{2}')
+def csv_bytes(transactions):
+    """CSV output as UTF-8 bytes.
 
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        date_match = date_pattern.match(line)
-        if date_match:
-            amounts = amount_pattern.findall(line)
-            if amounts:
-                date_str = parse_fnb_date(date_match.group())
-                description_start = date_match.end()
-                description = line[description_start:].strip()
-                for amt in amounts:
-                    description = description.replace(amt, '').strip()
-                amount_str = amounts[0].replace(',', '')
-                try:
-                    amount = float(amount_str)
-                    transactions.append((date_str, description, amount))
-                except ValueError:
-                    pass
-    return transactions
+    All rows go through one writerows() call into an in-memory buffer, so
+    the output is encoded once and its size is known before it is sent.
+    """
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXCEL_HEADERS)
+    writer.writerows(transactions)
+    return buf.getvalue().encode('utf-8')
 
-def extract_transactions_from_pdf(filepath, invert_amounts=False):
-    """Main extraction function — detects PDF type and uses correct method"""
+def create_csv_file(transactions, output_path):
+    """Create CSV file from transactions (output_path may be a binary stream)"""
+    data = csv_bytes(transactions)
+    if isinstance(output_path, str):
+        with open(output_path, 'wb') as f:
+            f.write(data)
+    else:
+        output_path.write(data)
 
-    # ── Detect PDF type ──
-    doc = fitz.open(filepath)
-    full_text = ''
-    for page in doc:
-        full_text += page.get_text()
-    doc.close()
+def create_parquet_file(transactions, output_path):
+    """Create a Parquet file from transactions (output_path may be a binary stream).
 
-    print(f"[INFO] fitz extracted {len(full_text)} chars from {filepath}", file=sys.stderr)
-    print(f"[INFO] First 200 chars: {repr(full_text[:200])}", file=sys.stderr)
-    print(f"[INFO] FULL TEXT: {repr(full_text)}", file=sys.stderr)
-
-    # Image-based PDF (no text layer) → use Claude vision
-    if len(full_text.strip()) < 50:
-        print(f"[INFO] Image-based PDF detected, using vision", file=sys.stderr)
-        transactions = extract_via_vision(filepath)
-        if invert_amounts:
-            transactions = [(d, desc, -amt) for d, desc, amt in transactions]
-        return transactions
-
-    # ── Text-based PDF ──
-    bank = detect_bank(full_text)
-    print(f"[INFO] Text-based PDF, detected bank: {bank}", file=sys.stderr)
-
-    if bank == 'ABSA':
-        transactions = extract_absa_transactions_text(full_text)
-    elif bank == 'STANDARD':
-        transactions = extract_standard_bank_transactions(full_text)
-    else:
-        transactions = extract_fnb_transactions(full_text)
+    Date is a date32 column (null for dates that are not DD/MM/YYYY),
+    Description is dictionary-encoded and Amount is float64. Needs pyarrow,
+    which is optional and only imported here.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError(PARQUET_UNAVAILABLE) from None
+    if not isinstance(transactions, TransactionBatch):
+        transactions = TransactionBatch.from_rows(transactions)
+    dates, descriptions, amounts = transactions.columns()
+    table = pa.table({
+        'Date': pa.array(dates, pa.date32()),
+        'Description': pa.array(descriptions, pa.string()).dictionary_encode(),
+        'Amount': pa.array(amounts, pa.float64()),
+    })
+    pq.write_table(table, output_path, compression='zstd')
+
+PARQUET_UNAVAILABLE = 'Parquet output needs the pyarrow package, which is not installed'
+
+OUTPUT_MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+}
 
-    if invert_amounts:
-        transactions = [(d, desc, -amt) for d, desc, amt in transactions]
+def output_extension(output_format):
+    """File extension for an output_format form value ('csv', 'parquet', anything else is xlsx)"""
+    return output_format if output_format in ('csv', 'parquet') else 'xlsx'
+
+def parquet_available():
+    """True if pyarrow, which Parquet output needs, is installed"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+def check_output_format(output_format):
+    """Raise ValueError if output_format needs an optional package that is missing"""
+    if output_extension(output_format) == 'parquet' and not parquet_available():
+        raise ValueError(PARQUET_UNAVAILABLE)
+
+def render_output(transactions, output_format):
+    """Build the XLSX/CSV/Parquet output in memory and return its bytes"""
+    ext = output_extension(output_format)
+    with metrics.timer('output_write'):
+        if ext == 'csv':
+            return csv_bytes(transactions)
+        buf = BytesIO()
+        if ext == 'parquet':
+            create_parquet_file(transactions, buf)
+        else:
+            create_excel_file(transactions, buf)
+        return buf.getvalue()
 
-    return transactions
+def encode_output(data):
+    """Base64 text of output bytes for a JSON response"""
+    with metrics.timer('encode'):
+        return base64.b64encode(data).decode()
 
 # ─────────────────────────────────────────────
-# OUTPUT FILE CREATION
+# BATCH CONVERSION (process pool)
 # ─────────────────────────────────────────────
 
-def create_excel_file(transactions, output_path):
-    """Create Excel file from transactions list"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Transactions"
+_convert_pool = None
+_convert_pool_lock = threading.Lock()
+
+def get_convert_pool():
+    """Shared process pool for per-file conversion, or None to run inline.
+
+    Created on first use with CONVERT_WORKERS processes. Uses the spawn start
+    method so workers never inherit locks held by this process's threads.
+    Falls back to inline conversion where processes are unavailable.
+    """
+    global _convert_pool
+    if app.config['CONVERT_WORKERS'] <= 1:
+        return None
+    with _convert_pool_lock:
+        if _convert_pool is None:
+            try:
+                _convert_pool = ProcessPoolExecutor(
+                    max_workers=app.config['CONVERT_WORKERS'],
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            except (OSError, NotImplementedError, ImportError) as e:
+                print(f"[BATCH] Process pool unavailable, converting inline: {e}", file=sys.stderr)
+                app.config['CONVERT_WORKERS'] = 1
+        return _convert_pool
+
+def _reset_convert_pool(broken):
+    """Drop a broken pool so the next get_convert_pool starts a fresh one.
+
+    Does nothing if another request has already replaced it.
+    """
+    global _convert_pool
+    with _convert_pool_lock:
+        if _convert_pool is broken and broken is not None:
+            _convert_pool.shutdown(wait=False, cancel_futures=True)
+            _convert_pool = None
+
+def extract_and_render(source, invert_amounts, output_format, page_range=None, pages=None):
+    """Raw extraction plus output rendering for one uploaded PDF.
+
+    Returns (raw TransactionBatch, page_errors, output_bytes). Raw rows are
+    kept, as compact columns, for the result cache. pages, when given, are
+    source's load_pdf_pages records, already loaded.
+    """
+    page_errors = []
+    raw = TransactionColumns()
+    parsed = iter_raw_transactions(source, page_errors, page_range=page_range, pages=pages)
+
+    def rows():
+        # The writer consumes rows as the parser yields them
+        for transaction in parsed:
+            raw.append(*transaction)
+            d, desc, amt = transaction
+            yield (d, desc, -amt) if invert_amounts else transaction
+
+    data = render_output(rows(), output_format)
+    return TransactionBatch.of(raw), page_errors, data
+
+# Settings load_pdf_pages reads to prepare scanned pages, sent with each pool
+# task so workers follow runtime changes to them
+PAGE_IMAGE_CONFIG = ('VISION_MAX_PIXELS', 'VISION_MAX_IMAGE_BYTES', 'VISION_GRAYSCALE',
+                     'VISION_CROP', 'VISION_JPEG_QUALITY')
+
+def pool_extract_and_render(source, invert_amounts, output_format, page_range, config):
+    """Pool task: extract_and_render for a text PDF; a scanned one only has its pages loaded.
+
+    Vision runs in the parent process only, where the vision cache, rate
+    limiter and VisionClient are shared by every request and follow runtime
+    config changes; a worker would have its own copy of each. A PDF with
+    scanned pages comes back as its page records (text and prepared page
+    images) for the parent to finish with extract_and_render(pages=...).
+
+    Returns (result, pages, timings): result is extract_and_render's tuple
+    and pages None, or result None and the pages; timings is what the task
+    recorded in metrics, for the parent to merge.
+    """
+    app.config.update(config)
+    pages = load_pdf_pages(source, page_range)
+    result = None
+    if not any(needs_vision(p) for p in pages):
+        result, pages = extract_and_render(source, invert_amounts, output_format, page_range, pages), None
+    return result, pages, metrics.drain()
+
+def iter_converted_uploads(files, invert_amounts, output_format, page_range=None):
+    """Convert uploaded PDFs, yielding (output_file, TransactionBatch) in upload order.
+
+    Cache hits are served in this process; misses are spread over the
+    process pool when there is more than one file. Scanned pages are read
+    by vision here, not in the pool (see pool_extract_and_render). At most
+    CONVERT_WORKERS files are in flight: each upload is read only when its
+    file is submitted and released once its output is yielded. A file that
+    fails yields {'original': name, 'error': msg} with transactions None,
+    and the rest of the batch carries on. page_range applies to every file.
+
+    If a worker dies, the broken pool takes every in-flight task with it.
+    Those files are run again on a fresh pool one at a time, so a file
+    that kills a worker while it is the only task in flight is the one
+    reported as failed.
+    """
+    ext = output_extension(output_format)
+    use_pool = len(files) > 1 and get_convert_pool() is not None
+    window = max(1, app.config['CONVERT_WORKERS']) if use_pool else 1
+    solo = False  # after a worker crash, one pool task at a time
+    pending = deque()
+    upcoming = iter(files)
+
+    def submit(task):
+        """Start a task on the current pool; its future stays None to convert inline"""
+        for _ in range(2):
+            pool = get_convert_pool()
+            if pool is None:
+                return
+            try:
+                task['future'] = pool.submit(pool_extract_and_render, task['source'], invert_amounts, output_format,
+                                             page_range, {name: app.config[name] for name in PAGE_IMAGE_CONFIG})
+                task['pool'] = pool
+                return
+            except (BrokenProcessPool, RuntimeError):  # broken or shut down by another request
+                _reset_convert_pool(pool)
+
+    def add(file):
+        task = {'filename': file.filename, 'source': None, 'cached': None, 'future': None, 'pool': None,
+                'error': None, 'in_pool': False}
+        pending.append(task)
+        try:
+            task['source'] = read_upload(file)
+            task['key'] = result_cache_key(task['source'], page_range)
+            task['cached'] = result_cache.get(task['key'])
+        except Exception as e:
+            task['error'] = e
+            return
+        task['in_pool'] = use_pool and task['cached'] is None
+        if task['in_pool'] and not solo:
+            submit(task)
 
-    # Header
-    header_fill = PatternFill(start_color="1F4E79", end_color="1F4E79", fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True)
-    headers = ['Date', 'Description', 'Amount']
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center')
-
-    # Data
-    for row_idx, (date_str, description, amount) in enumerate(transactions, 2):
-        ws.cell(row=row_idx, column=1, value=date_str)
-        ws.cell(row=row_idx, column=2, value=description)
-        amount_cell = ws.cell(row=row_idx, column=3, value=amount)
-        if amount < 0:
-            amount_cell.font = Font(color="C00000")
+    try:
+        while True:
+            for file in upcoming:
+                add(file)
+                if len(pending) >= window:
+                    break
+            if not pending:
+                break
+            task = pending[0]
+            filename = task['filename']
+            try:
+                if task['error'] is not None:
+                    raise task['error']
+                if task['cached'] is not None:
+                    raw, page_errors = TransactionBatch.from_rows(task['cached']), []
+                    transactions = raw.invert() if invert_amounts else raw
+                    data = render_output(transactions, output_format)
+                else:
+                    result = pages = None
+                    if task['in_pool'] and task['future'] is None:
+                        submit(task)
+                    if task['future'] is not None:
+                        try:
+                            result, pages, timings = task['future'].result()
+                        except BrokenProcessPool:
+                            _reset_convert_pool(task['pool'])
+                            if solo:  # it was alone in flight, so this file killed the worker
+                                raise RuntimeError('Conversion crashed its worker process') from None
+                            solo = True
+                            lost = 0
+                            for other in pending:
+                                future = other['future']
+                                if future is not None and (not future.done() or isinstance(
+                                        future.exception(), BrokenProcessPool)):
+                                    other['future'] = None
+                                    lost += 1
+                            print(f"[BATCH] A worker died; re-running {lost} in-flight file(s) one at a time",
+                                  file=sys.stderr)
+                            continue
+                        metrics.merge(timings)
+                    if result is None:
+                        result = extract_and_render(task['source'], invert_amounts, output_format, page_range, pages)
+                    raw, page_errors, data = result
+                    if not page_errors:
+                        result_cache.put(task['key'], tuple(raw))
+                    transactions = raw.invert() if invert_amounts else raw
+            except Exception as e:
+                print(f"[BATCH] {filename} failed: {e}", file=sys.stderr)
+                output_file, transactions = {'original': filename, 'error': str(e)}, None
+            else:
+                output_file = {
+                    'original': filename,
+                    'output': filename.replace('.pdf', f'_transactions.{ext}'),
+                    'transactions': len(transactions),
+                    'page_errors': page_errors,
+                    'data': data,
+                }
+            pending.popleft()
+            release_upload(task['source'])
+            yield output_file, transactions
+    finally:
+        for task in pending:
+            if task['future'] is not None:
+                task['future'].cancel()
+            release_upload(task['source'])
 
-    # Column widths
-    ws.column_dimensions['A'].width = 15
-    ws.column_dimensions['B'].width = 60
-    ws.column_dimensions['C'].width = 15
+# ─────────────────────────────────────────────
+# BACKGROUND JOBS
+# ─────────────────────────────────────────────
 
-    wb.save(output_path)
+JOBS_FOLDER = os.path.join(OUTPUT_FOLDER, 'jobs')
+os.makedirs(JOBS_FOLDER, exist_ok=True)
+
+JOB_FILE_FIELDS = ('status', 'pages_done', 'pages_total', 'transactions', 'page_errors', 'error')
+
+class JobStore:
+    """SQLite-backed conversion jobs and their per-file progress.
+
+    A new connection is opened per call, so the store can be shared by the
+    request threads and the job worker pool of one process (and by several
+    processes on the same box). Each job records the pid of the process
+    working on it, so jobs left behind by one that has exited can be found
+    (see recover_jobs).
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    output_format TEXT NOT NULL,
+                    invert_amounts INTEGER NOT NULL,
+                    combined_file TEXT,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    owner INTEGER,
+                    chunked INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS job_files (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    original TEXT NOT NULL,
+                    output TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    pages_done INTEGER NOT NULL DEFAULT 0,
+                    pages_total INTEGER,
+                    transactions INTEGER NOT NULL DEFAULT 0,
+                    page_errors TEXT NOT NULL DEFAULT '[]',
+                    error TEXT,
+                    PRIMARY KEY (job_id, idx)
+                );
+            ''')
+            # Stores created before jobs had an owner
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for name, decl in (('owner', 'INTEGER'), ('chunked', 'INTEGER NOT NULL DEFAULT 0')):
+                if name not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {name} {decl}')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create_job(self, job_id, files, output_format, invert_amounts, chunked=False):
+        """files is a list of (original, output) names in upload order"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, output_format, invert_amounts, created, updated, owner, chunked) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, 'queued', output_format, int(invert_amounts), now, now, os.getpid(), int(chunked)))
+            conn.executemany(
+                'INSERT INTO job_files (job_id, idx, original, output, status) VALUES (?, ?, ?, ?, ?)',
+                [(job_id, idx, original, output, 'queued') for idx, (original, output) in enumerate(files)])
+
+    def update_file(self, job_id, idx, **fields):
+        assert set(fields) <= set(JOB_FILE_FIELDS)
+        if 'page_errors' in fields:
+            fields['page_errors'] = json.dumps(fields['page_errors'])
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        with self._connect() as conn:
+            conn.execute(f'UPDATE job_files SET {columns} WHERE job_id = ? AND idx = ?',
+                         (*fields.values(), job_id, idx))
+            conn.execute('UPDATE jobs SET updated = ? WHERE id = ?', (time.time(), job_id))
+
+    def set_status(self, job_id, status, expected=None, **fields):
+        """Move a job to status; with expected, only from that status. Returns True if updated."""
+        assert set(fields) <= {'combined_file', 'error', 'owner'}
+        columns = ''.join(f', {name} = ?' for name in fields)
+        sql = f'UPDATE jobs SET status = ?, updated = ?{columns} WHERE id = ?'
+        params = [status, time.time(), *fields.values(), job_id]
+        if expected is not None:
+            sql += ' AND status = ?'
+            params.append(expected)
+        with self._connect() as conn:
+            return conn.execute(sql, params).rowcount == 1
+
+    def get_job(self, job_id):
+        with self._connect() as conn:
+            job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if job is None:
+                return None
+            files = conn.execute('SELECT * FROM job_files WHERE job_id = ? ORDER BY idx', (job_id,)).fetchall()
+        job = dict(job)
+        job['invert_amounts'] = bool(job['invert_amounts'])
+        job['chunked'] = bool(job['chunked'])
+        job['files'] = []
+        for row in files:
+            entry = dict(row)
+            del entry['job_id']
+            entry['page_errors'] = json.loads(entry['page_errors'])
+            job['files'].append(entry)
+        return job
+
+    def unfinished_jobs(self):
+        """(id, owner) of every job that is queued, running or combining"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, owner FROM jobs WHERE status IN ('queued', 'running', 'combining')")
+            return [(row['id'], row['owner']) for row in rows.fetchall()]
+
+    def claim(self, job_id, owner):
+        """Take over a job from owner (a pid that has exited); False if another process got there first"""
+        with self._connect() as conn:
+            return conn.execute('UPDATE jobs SET owner = ? WHERE id = ? AND owner IS ?',
+                                (os.getpid(), job_id, owner)).rowcount == 1
+
+    def expired_job_ids(self, ttl):
+        with self._connect() as conn:
+            rows = conn.execute('SELECT id FROM jobs WHERE updated < ?', (time.time() - ttl,)).fetchall()
+        return [row['id'] for row in rows]
+
+    def delete_job(self, job_id):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM job_files WHERE job_id = ?', (job_id,))
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+job_store = JobStore(os.path.join(JOBS_FOLDER, 'jobs.db'))
+job_executor = ThreadPoolExecutor(max_workers=max(1, app.config['JOB_WORKERS']))
+
+def job_dir(job_id):
+    return os.path.join(JOBS_FOLDER, job_id)
+
+def job_output_path(job_id, idx, output_name):
+    """On-disk path of a file's output; idx keeps same-named uploads apart"""
+    return os.path.join(job_dir(job_id), f'{idx}-{output_name}')
+
+def store_job_uploads(files, invert_amounts, output_format, chunked=False):
+    """Save the uploads under a new queued job and return the job id"""
+    purge_expired_jobs()
+    job_id = uuid.uuid4().hex
+    os.makedirs(job_dir(job_id))
+    ext = output_extension(output_format)
+    names = []
+    for idx, file in enumerate(files):
+        file.save(os.path.join(job_dir(job_id), f'{idx}.pdf'))
+        names.append((file.filename, file.filename.replace('.pdf', f'_transactions.{ext}')))
+    job_store.create_job(job_id, names, output_format, invert_amounts, chunked)
+    return job_id
+
+def submit_job(files, invert_amounts, output_format):
+    """Store the uploads, queue one task per file and return the job id"""
+    job_id = store_job_uploads(files, invert_amounts, output_format)
+    for idx in range(len(files)):
+        job_executor.submit(run_job_file, job_id, idx)
+    return job_id
+
+def run_job_file(job_id, idx):
+    """Worker task: convert one file of a job, recording progress as it goes"""
+    job = job_store.get_job(job_id)
+    if job is None:
+        return
+    job_store.set_status(job_id, 'running', expected='queued')
+    job_store.update_file(job_id, idx, status='running')
+    entry = job['files'][idx]
+    pdf_path = os.path.join(job_dir(job_id), f'{idx}.pdf')
+
+    def progress(pages_done, pages_total, transactions_so_far):
+        job_store.update_file(job_id, idx, pages_done=pages_done, pages_total=pages_total,
+                              transactions=transactions_so_far)
+
+    page_errors = []
+    try:
+        transactions = extract_transactions_from_pdf(pdf_path, job['invert_amounts'], page_errors, progress)
+        with open(job_output_path(job_id, idx, entry['output']), 'wb') as f:
+            f.write(render_output(transactions, job['output_format']))
+        with open(os.path.join(job_dir(job_id), f'{idx}.json'), 'w', encoding='utf-8') as f:
+            json.dump(transactions, f)
+        job_store.update_file(job_id, idx, status='done', transactions=len(transactions),
+                              page_errors=page_errors)
+    except Exception as e:
+        import traceback
+        print(f"[JOB] {job_id} file {idx} failed: {traceback.format_exc()}", file=sys.stderr)
+        job_store.update_file(job_id, idx, status='failed', error=str(e), page_errors=page_errors)
+    finally:
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+
+    finish_job_if_complete(job_id)
+
+def finish_job_if_complete(job_id):
+    """Once every file has finished, build the combined output and close the job"""
+    job = job_store.get_job(job_id)
+    if any(f['status'] not in ('done', 'failed') for f in job['files']):
+        return
+    # Only the task that wins this transition builds the combined file
+    if not job_store.set_status(job_id, 'combining', expected='running'):
+        return
+
+    done = [f for f in job['files'] if f['status'] == 'done']
+    if not done:
+        job_store.set_status(job_id, 'failed', error='No files could be converted')
+        return
+
+    combined_name = None
+    try:
+        if len(job['files']) > 1:
+            batches = []
+            for f in done:
+                with open(os.path.join(job_dir(job_id), f"{f['idx']}.json"), encoding='utf-8') as fh:
+                    batches.append(TransactionBatch.from_rows(json.load(fh)))
+            all_transactions = TransactionBatch.concat(batches)
+            ext = output_extension(job['output_format'])
+            combined_name = f'combined_transactions_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{ext}'
+            with open(os.path.join(job_dir(job_id), combined_name), 'wb') as fh:
+                fh.write(render_output(all_transactions, job['output_format']))
+    except Exception as e:
+        import traceback
+        print(f"[JOB] {job_id} combine failed: {traceback.format_exc()}", file=sys.stderr)
+        job_store.set_status(job_id, 'failed', error=f'Combining outputs failed: {e}')
+        return
+    job_store.set_status(job_id, 'done', combined_file=combined_name)
+
+def _process_alive(pid):
+    """True if pid is a running process other than this one"""
+    if pid is None or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
+
+def recover_jobs():
+    """Pick up jobs whose process exited (a restart or crash) before they finished.
+
+    Files still queued, or interrupted while running, are converted again
+    from their saved upload, and a job interrupted while combining is
+    combined again. A chunked job interrupted mid-chunk is reopened, so
+    its client can resend the cursor. Jobs whose owning process is still
+    alive are left to it. Returns the ids of the jobs picked up.
+    """
+    recovered = []
+    for job_id, owner in job_store.unfinished_jobs():
+        if _process_alive(owner) or not job_store.claim(job_id, owner):
+            continue
+        job = job_store.get_job(job_id)
+        recovered.append(job_id)
+        print(f"[JOB] {job_id} was {job['status']} when process {owner} exited, resuming", file=sys.stderr)
+        if job['chunked']:
+            job_store.set_status(job_id, 'open')
+            continue
+        if job['status'] == 'combining':
+            job_store.set_status(job_id, 'running', expected='combining')
+            job_executor.submit(finish_job_if_complete, job_id)
+            continue
+        resubmit = []
+        for entry in job['files']:
+            if entry['status'] not in ('queued', 'running'):
+                continue
+            if os.path.exists(os.path.join(job_dir(job_id), f"{entry['idx']}.pdf")):
+                job_store.update_file(job_id, entry['idx'], status='queued')
+                resubmit.append(entry['idx'])
+            else:
+                job_store.update_file(job_id, entry['idx'], status='failed', error='Upload lost in a restart')
+        if resubmit:
+            for idx in resubmit:
+                job_executor.submit(run_job_file, job_id, idx)
+        else:
+            job_store.set_status(job_id, 'running', expected='queued')
+            job_executor.submit(finish_job_if_complete, job_id)
+    return recovered
+
+# Recovery runs on a process's first job request rather than at import, so
+# tests, benchmarks, pool workers and a preloading server master that import
+# this module never take jobs over (nor start job threads before a fork)
+_jobs_recovered = False
+_jobs_recovered_lock = threading.Lock()
+
+def ensure_jobs_recovered():
+    """Run recover_jobs once in this process"""
+    global _jobs_recovered
+    with _jobs_recovered_lock:
+        if not _jobs_recovered:
+            _jobs_recovered = True
+            recover_jobs()
+
+def purge_expired_jobs():
+    """Delete jobs (records and files) not updated within JOB_TTL"""
+    for job_id in job_store.expired_job_ids(app.config['JOB_TTL']):
+        shutil.rmtree(job_dir(job_id), ignore_errors=True)
+        job_store.delete_job(job_id)
+
+# ── Chunked jobs ──
+#
+# A long statement can be converted a few pages per request. The job holds
+# one PDF and sits in status 'open' between chunks. Each chunk appends its
+# rows to the job's 0.jsonl row log, and the output is rendered from that
+# log once the last page is done. The client carries the position in a
+# cursor: next page, row-log size, detected bank and the open parser's
+# state, so an ABSA block split across a chunk boundary still parses.
+
+_cursor_key = None
+_cursor_key_lock = threading.Lock()
+
+def cursor_key():
+    """Key that signs chunk cursors: CURSOR_SECRET, or a random one kept in JOBS_FOLDER.
+
+    The generated key is written once (linked into place, so concurrent
+    processes agree on it) and survives restarts, like the jobs it signs for.
+    """
+    global _cursor_key
+    if app.config['CURSOR_SECRET']:
+        return app.config['CURSOR_SECRET'].encode()
+    with _cursor_key_lock:
+        if _cursor_key is None:
+            path = os.path.join(JOBS_FOLDER, 'cursor.key')
+            fd, tmp = tempfile.mkstemp(dir=JOBS_FOLDER)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(os.urandom(32))
+                try:
+                    os.link(tmp, path)
+                except FileExistsError:
+                    pass
+            finally:
+                os.remove(tmp)
+            with open(path, 'rb') as f:
+                _cursor_key = f.read()
+        return _cursor_key
+
+def _cursor_signature(payload):
+    return base64.urlsafe_b64encode(hmac.new(cursor_key(), payload, hashlib.sha256).digest()).decode()
+
+def encode_cursor(cursor):
+    """Opaque URL-safe token for a chunk cursor, signed with cursor_key"""
+    payload = base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode())
+    return f'{payload.decode()}.{_cursor_signature(payload)}'
+
+def decode_cursor(token):
+    """Chunk cursor from encode_cursor; ValueError if it is not one or its signature does not match"""
+    payload, _, signature = token.partition('.')
+    if not hmac.compare_digest(signature.encode(), _cursor_signature(payload.encode()).encode()):
+        raise ValueError('Invalid cursor')
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(payload.encode()))
+    except ValueError:
+        raise ValueError('Invalid cursor') from None
+    if not isinstance(cursor, dict) or not {'job', 'page', 'offset', 'rows'} <= set(cursor):
+        raise ValueError('Invalid cursor')
+    return cursor
+
+def check_cursor(cursor, job):
+    """Raise ValueError unless a decoded cursor fits the chunked job it names.
+
+    page, rows and offset may point back to an earlier chunk (to redo it)
+    but not past what has been converted and logged; bank and route must
+    be ones a chunk could have saved.
+    """
+    entry = job['files'][0]
+    rows_path = os.path.join(job_dir(job['id']), '0.jsonl')
+    logged = os.path.getsize(rows_path) if os.path.exists(rows_path) else 0
+    for key, limit in (('page', entry['pages_done']), ('rows', entry['transactions']), ('offset', logged)):
+        value = cursor[key]
+        if type(value) is not int or not 0 <= value <= limit:
+            raise ValueError(f'Invalid cursor: {key} out of range')
+    if cursor.get('bank') not in (None, UNKNOWN_BANK, *BANK_PARSERS):
+        raise ValueError('Invalid cursor: unknown bank')
+    if cursor.get('route') not in (None, 'garbled', 'text'):
+        raise ValueError('Invalid cursor: unknown route')
+    if cursor.get('route') and not isinstance(cursor.get('parser'), dict):
+        raise ValueError('Invalid cursor: open parser without state')
+    if cursor.get('route') == 'text' and cursor.get('bank') in (None, UNKNOWN_BANK):
+        raise ValueError('Invalid cursor: open parser without a bank')
+
+def start_chunked_job(file, invert_amounts, output_format):
+    """Store one upload as an open chunked job and return its first cursor"""
+    job_id = store_job_uploads([file], invert_amounts, output_format, chunked=True)
+    job_store.set_status(job_id, 'open', expected='queued')
+    return {'job': job_id, 'page': 0, 'offset': 0, 'rows': 0}
+
+def run_job_chunk(cursor, chunk_pages):
+    """Convert the next chunk_pages pages of a chunked job claimed as 'running'.
+
+    The row log is first cut back to the cursor's offset, so re-sending an
+    earlier cursor redoes that chunk without duplicating rows. Returns the
+    response body, with the next cursor (None after the last page).
+    """
+    job_id = cursor['job']
+    job = job_store.get_job(job_id)
+    entry = job['files'][0]
+    pdf_path = os.path.join(job_dir(job_id), '0.pdf')
+    rows_path = os.path.join(job_dir(job_id), '0.jsonl')
+
+    doc = open_pdf(pdf_path)
+    pages_total = doc.page_count
+    doc.close()
+    start = cursor['page']
+    stop = min(pages_total, start + chunk_pages)
+    job_store.update_file(job_id, 0, status='running', pages_total=pages_total)
+
+    state = {key: cursor[key] for key in ('bank', 'route', 'parser') if key in cursor}
+    page_errors = []
+    transactions = list(iter_raw_transactions(pdf_path, page_errors, page_range=(start, stop), cursor=state))
+    done = stop >= pages_total
+    if done:
+        transaction = flush_cursor(state)
+        if transaction is not None:
+            transactions.append(transaction)
+    if job['invert_amounts']:
+        transactions = [(d, desc, -amt) for d, desc, amt in transactions]
 
-def create_csv_file(transactions, output_path):
-    """Create CSV file from transactions list"""
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['Date', 'Description', 'Amount'])
-        for date_str, description, amount in transactions:
-            writer.writerow([date_str, description, amount])
+    with open(rows_path, 'a+b') as f:
+        f.truncate(cursor['offset'])
+        f.seek(cursor['offset'])
+        for transaction in transactions:
+            f.write(json.dumps(transaction).encode() + b'\n')
+        offset = f.tell()
+    rows = cursor['rows'] + len(transactions)
+    # Errors from pages this chunk redid are replaced, not repeated
+    page_errors = [e for e in entry['page_errors'] if e['page'] < start] + page_errors
+    job_store.update_file(job_id, 0, pages_done=stop, transactions=rows, page_errors=page_errors)
+
+    result = {
+        'job_id': job_id,
+        'pages': [start + 1, stop],
+        'pages_total': pages_total,
+        'transactions': len(transactions),
+        'total_transactions': rows,
+        'page_errors': page_errors,
+        'done': done,
+        'cursor': None,
+        'status_url': url_for('job_status', job_id=job_id),
+    }
+    if not done:
+        result['cursor'] = encode_cursor(dict(cursor, page=stop, offset=offset, rows=rows, **state))
+        return result
+
+    def logged_rows():
+        with open(rows_path, encoding='utf-8') as f:
+            for line in f:
+                yield tuple(json.loads(line))
+
+    with open(job_output_path(job_id, 0, entry['output']), 'wb') as f:
+        f.write(render_output(logged_rows(), job['output_format']))
+    job_store.update_file(job_id, 0, status='done')
+    finish_job_if_complete(job_id)
+    result['result_url'] = url_for('job_result', job_id=job_id)
+    return result
 
 # ─────────────────────────────────────────────
 # FLASK ROUTES
@@ -580,15 +2841,40 @@ def index():
 
 @app.route('/tools/bank-statement-converter')
 def bank_statement_converter():
-    return render_template('bank_statement_converter.html')
+    return render_template('bank_statement_converter.html', parquet_available=parquet_available())
 
 @app.route('/tools/tax-optimizer')
 def tax_optimizer():
     return render_template('tax_optimizer.html')
 
+def parse_page_range(value):
+    """'3-10', '5' or '7-' (1-based, inclusive) -> 0-based (start, stop); None if blank"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    first, sep, last = value.partition('-')
+    try:
+        start = int(first) - 1
+        stop = int(last) if last.strip() else (sys.maxsize if sep else start + 1)
+    except ValueError:
+        raise ValueError(f'Invalid page range: {value}') from None
+    if start < 0 or stop <= start:
+        raise ValueError(f'Invalid page range: {value}')
+    return start, stop
+
 @app.route('/convert', methods=['POST'])
 def convert():
-    """Handle PDF conversion"""
+    """Handle PDF conversion.
+
+    response_mode=json (default) returns base64 file data inside JSON for the
+    web UI. response_mode=download returns the file itself as a streamed
+    attachment: the XLSX/CSV for one statement, or a ZIP for a batch.
+    response_mode=zip always returns a ZIP, written incrementally: each
+    statement's output is streamed as soon as it is converted, followed by
+    the combined file and a summary.json with per-file counts and errors.
+    pages=3-10 converts only that page range (1-based, inclusive) of each
+    file; see /convert/chunk for working through a long statement.
+    """
     try:
         if 'files[]' not in request.files:
             return jsonify({'error': 'No files uploaded'}), 400
@@ -598,64 +2884,55 @@ def convert():
             return jsonify({'error': 'No files selected'}), 400
 
         invert_amounts = request.form.get('invert_amounts') == 'true'
-        output_format = request.form.get('output_format', 'xlsx')  # 'xlsx' or 'csv'
+        output_format = request.form.get('output_format', 'xlsx')  # 'xlsx', 'csv' or 'parquet'
+        response_mode = request.form.get('response_mode', 'json')  # 'json', 'download' or 'zip'
+        try:
+            check_output_format(output_format)
+            page_range = parse_page_range(request.form.get('pages'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        ext = output_extension(output_format)
+        files = [f for f in files if f and f.filename.endswith('.pdf')]
+
+        if response_mode == 'zip' or (response_mode == 'download' and len(files) > 1):
+            combined_name = f'combined_transactions_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{ext}'
+            zip_name = combined_name.rsplit('.', 1)[0] + '.zip'
+            return Response(
+                stream_with_context(stream_zip_batch(files, invert_amounts, output_format, combined_name, page_range)),
+                mimetype='application/zip',
+                headers={'Content-Disposition': f'attachment; filename={zip_name}'},
+            )
 
         output_files = []
-        all_transactions = []
-
-        for file in files:
-            if file and file.filename.endswith('.pdf'):
-                filename = file.filename
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
+        batches = []
 
-                transactions = extract_transactions_from_pdf(filepath, invert_amounts)
-                all_transactions.extend(transactions)
+        for output_file, transactions in iter_converted_uploads(files, invert_amounts, output_format, page_range):
+            if transactions is not None:
+                batches.append(transactions)
+            output_files.append(output_file)
+        all_transactions = TransactionBatch.concat(batches)
 
-                if output_format == 'csv':
-                    output_filename = filename.replace('.pdf', '_transactions.csv')
-                    output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-                    create_csv_file(transactions, output_path)
-                else:
-                    output_filename = filename.replace('.pdf', '_transactions.xlsx')
-                    output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-                    create_excel_file(transactions, output_path)
+        converted = [f for f in output_files if 'error' not in f]
+        if not converted:
+            return jsonify({'error': output_files[0]['error'] if output_files else 'No PDF files uploaded',
+                            'files': output_files}), 500
 
-                # Read file bytes for response
-                with open(output_path, 'rb') as f:
-                    file_bytes = f.read()
-
-                output_files.append({
-                    'original': filename,
-                    'output': output_filename,
-                    'transactions': len(transactions),
-                    'file_data': base64.b64encode(file_bytes).decode()
-                })
-
-                os.remove(filepath)
-                os.remove(output_path)
+        if response_mode == 'download':
+            only = converted[0]
+            return send_file(BytesIO(only['data']), mimetype=OUTPUT_MIMETYPES[ext],
+                             as_attachment=True, download_name=only['output'])
 
         # Multiple files: also create combined
         if len(output_files) > 1:
-            if output_format == 'csv':
-                combined_name = f'combined_transactions_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-                combined_path = os.path.join(app.config['OUTPUT_FOLDER'], combined_name)
-                create_csv_file(all_transactions, combined_path)
-            else:
-                combined_name = f'combined_transactions_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-                combined_path = os.path.join(app.config['OUTPUT_FOLDER'], combined_name)
-                create_excel_file(all_transactions, combined_path)
-
-            with open(combined_path, 'rb') as f:
-                combined_bytes = f.read()
-            os.remove(combined_path)
+            combined_name = f'combined_transactions_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{ext}'
+            combined_bytes = render_output(all_transactions, output_format)
 
             return jsonify({
                 'success': True,
                 'multiple': True,
-                'files': output_files,
+                'files': [json_file_entry(f) for f in output_files],
                 'combined_file': combined_name,
-                'combined_data': base64.b64encode(combined_bytes).decode(),
+                'combined_data': encode_output(combined_bytes),
                 'total_transactions': len(all_transactions)
             })
         else:
@@ -664,7 +2941,8 @@ def convert():
                 'multiple': False,
                 'file': output_files[0]['output'],
                 'transactions': output_files[0]['transactions'],
-                'file_data': output_files[0]['file_data']
+                'page_errors': output_files[0]['page_errors'],
+                'file_data': encode_output(output_files[0]['data'])
             })
 
     except Exception as e:
@@ -672,6 +2950,199 @@ def convert():
         return jsonify({'error': str(e), 'traceback': traceback.format_exc()}), 500
 
 
+def json_file_entry(output_file):
+    """Per-file entry of the JSON response, with the output base64-encoded"""
+    entry = {k: v for k, v in output_file.items() if k != 'data'}
+    if 'data' in output_file:
+        entry['file_data'] = encode_output(output_file['data'])
+    return entry
+
+
+class ZipStreamSink:
+    """Write-only file object for zipfile that buffers bytes until drained.
+
+    It reports tell() but cannot seek, so zipfile writes data descriptors
+    and each member can be sent to the client as soon as it is written.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip_batch(files, invert_amounts, output_format, combined_name, page_range=None):
+    """Yield a ZIP of per-file outputs, the combined file and summary.json.
+
+    Peak memory stays near one file's output plus the combined transaction
+    columns. A file that fails to convert is recorded in summary.json and the
+    rest of the batch continues.
+    """
+    sink = ZipStreamSink()
+    summary = {'files': [], 'combined_file': combined_name, 'total_transactions': 0}
+    batches = []
+
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for output_file, transactions in iter_converted_uploads(files, invert_amounts, output_format, page_range):
+            if transactions is None:
+                summary['files'].append(output_file)
+                continue
+            zf.writestr(output_file['output'], output_file.pop('data'))
+            summary['files'].append(output_file)
+            batches.append(transactions)
+            yield sink.drain()
+
+        all_transactions = TransactionBatch.concat(batches)
+        zf.writestr(combined_name, render_output(all_transactions, output_format))
+        summary['total_transactions'] = len(all_transactions)
+        zf.writestr('summary.json', json.dumps(summary, indent=2))
+    yield sink.drain()
+
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a conversion in the background; takes the same form as /convert"""
+    if 'files[]' not in request.files:
+        return jsonify({'error': 'No files uploaded'}), 400
+
+    files = [f for f in request.files.getlist('files[]') if f and f.filename.endswith('.pdf')]
+    if not files:
+        return jsonify({'error': 'No files selected'}), 400
+
+    invert_amounts = request.form.get('invert_amounts') == 'true'
+    output_format = request.form.get('output_format', 'xlsx')  # 'xlsx', 'csv' or 'parquet'
+    try:
+        check_output_format(output_format)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    job_id = submit_job(files, invert_amounts, output_format)
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id),
+        'result_url': url_for('job_result', job_id=job_id),
+    }), 202
+
+
+@app.route('/convert/chunk', methods=['POST'])
+def convert_chunk():
+    """Convert a long statement a chunk of pages per request.
+
+    The first request uploads `file` (with output_format / invert_amounts)
+    and starts a chunked job. Each response carries a cursor to send back
+    for the next chunk until done is true; the output is then at
+    result_url. chunk_pages sets the chunk size (default CHUNK_PAGES).
+    Re-sending an earlier cursor redoes that chunk without duplicating rows.
+    """
+    try:
+        chunk_pages = int(request.form.get('chunk_pages', app.config['CHUNK_PAGES']))
+    except ValueError:
+        chunk_pages = 0
+    if chunk_pages < 1:
+        return jsonify({'error': 'chunk_pages must be a positive integer'}), 400
+
+    token = request.form.get('cursor')
+    if token:
+        try:
+            cursor = decode_cursor(token)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        job = job_store.get_job(cursor['job'])
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        try:
+            check_cursor(cursor, job)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        file = request.files.get('file')
+        if file is None or not file.filename.endswith('.pdf'):
+            return jsonify({'error': 'No file uploaded'}), 400
+        invert_amounts = request.form.get('invert_amounts') == 'true'
+        output_format = request.form.get('output_format', 'xlsx')  # 'xlsx', 'csv' or 'parquet'
+        try:
+            check_output_format(output_format)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        cursor = start_chunked_job(file, invert_amounts, output_format)
+
+    # One chunk at a time per job
+    job_id = cursor['job']
+    if not job_store.set_status(job_id, 'running', expected='open', owner=os.getpid()):
+        status = job_store.get_job(job_id)['status']
+        return jsonify({'error': f'Job is {status}', 'status': status}), 409
+    try:
+        return jsonify(run_job_chunk(cursor, chunk_pages))
+    except Exception as e:
+        import traceback
+        print(f"[JOB] {job_id} chunk from page {cursor['page']} failed: {traceback.format_exc()}", file=sys.stderr)
+        return jsonify({'error': str(e), 'cursor': encode_cursor(cursor)}), 500
+    finally:
+        job_store.set_status(job_id, 'open', expected='running')
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Job status with per-file progress (pages done, transactions so far)"""
+    job = job_store.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    del job['owner']
+    return jsonify(job)
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Download a finished job's output.
+
+    ?file=<output name> returns one per-file or combined output; otherwise a
+    single-file job returns its output and a batch returns a ZIP of all of them.
+    """
+    job = job_store.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"Job is {job['status']}", 'status': job['status']}), 409
+
+    ext = output_extension(job['output_format'])
+    outputs = [(f['output'], job_output_path(job_id, f['idx'], f['output']))
+               for f in job['files'] if f['status'] == 'done']
+    if job['combined_file']:
+        outputs.append((job['combined_file'], os.path.join(job_dir(job_id), job['combined_file'])))
+
+    requested = request.args.get('file')
+    if requested is None and len(outputs) == 1:
+        requested = outputs[0][0]
+    if requested is not None:
+        for name, path in outputs:
+            if name == requested:
+                return send_file(path, mimetype=OUTPUT_MIMETYPES[ext], as_attachment=True, download_name=name)
+        return jsonify({'error': 'File not found in job'}), 404
+
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, path in outputs:
+            zf.write(path, arcname=name)
+    buf.seek(0)
+    return send_file(buf, mimetype='application/zip', as_attachment=True,
+                     download_name=job['combined_file'].rsplit('.', 1)[0] + '.zip')
+
+
 @app.route('/test-vision', methods=['POST'])
 def test_vision():
     """Test endpoint - upload a PDF and see exactly what happens"""
@@ -679,71 +3150,50 @@ def test_vision():
         return jsonify({'error': 'No file uploaded'})
     
     file = request.files['file']
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-    file.save(filepath)
+    source = read_upload(file)
     
     result = {'filename': file.filename, 'steps': []}
     
     # Step 1: Check if image-based
     try:
-        doc = fitz.open(filepath)
-        page_texts = []
-        for i, page in enumerate(doc):
-            t = page.get_text()
-            page_texts.append(f"page{i}: {len(t)} chars")
+        pages = load_pdf_pages(source)
+        page_texts = [f"page{p['number']}: {len(p['text'])} chars" for p in pages]
         result['steps'].append(f"fitz opened OK, pages: {page_texts}")
-        img_based = is_image_based_pdf(filepath)
+        img_based = is_image_based_pdf(pages)
         result['steps'].append(f"is_image_based: {img_based}")
+        vision_pages = [p['number'] for p in pages if needs_vision(p)]
+        result['steps'].append(f"pages routed to vision: {vision_pages}")
     except Exception as e:
         result['steps'].append(f"fitz ERROR: {e}")
-        os.remove(filepath)
+        release_upload(source)
         return jsonify(result)
     
-    if not img_based:
-        result['steps'].append("NOT image-based - would use text extraction")
-        os.remove(filepath)
+    if not vision_pages:
+        result['steps'].append("No scanned pages - would use text extraction")
+        release_upload(source)
         return jsonify(result)
     
     # Step 2: Extract images
     try:
-        imgs = get_page_images_b64(filepath)
+        imgs = get_page_images_b64(pages)
         result['steps'].append(f"extracted {len(imgs)} page images, sizes: {[len(i) for i in imgs]}")
+        result['page_images'] = page_image_report(pages)
     except Exception as e:
         result['steps'].append(f"image extraction ERROR: {e}")
-        os.remove(filepath)
+        release_upload(source)
         return jsonify(result)
     
     # Step 3: Call vision API on first page only
     try:
         api_key = os.environ.get('ANTHROPIC_API_KEY', '')
-        content_msg = [
-            {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": imgs[0]}},
-            {"type": "text", "text": "Extract all transaction rows from this bank statement page. Return JSON array only."}
-        ]
-        payload = json.dumps({
-            "model": "claude-sonnet-4-20250514",
-            "max_tokens": 4000,
-            "system": VISION_SYSTEM_PROMPT,
-            "messages": [{"role": "user", "content": content_msg}]
-        }).encode()
-        
-        req = urllib.request.Request(
-            'https://api.anthropic.com/v1/messages',
-            data=payload,
-            headers={
-                'Content-Type': 'application/json',
-                'anthropic-version': '2023-06-01',
-                'x-api-key': api_key
-            }
-        )
-        with urllib.request.urlopen(req, timeout=60) as resp:
-            api_result = json.loads(resp.read())
-            raw_text = api_result['content'][0]['text']
-            result['steps'].append(f"API call OK, raw response ({len(raw_text)} chars): {raw_text[:500]}")
+        api_result = get_vision_client().post(vision_page_payload(imgs[0]), api_key,
+                                              time.monotonic() + app.config['VISION_REQUEST_TIMEOUT'])
+        raw_text = api_result['content'][0]['text']
+        result['steps'].append(f"API call OK, raw response ({len(raw_text)} chars): {raw_text[:500]}")
     except Exception as e:
         result['steps'].append(f"API call ERROR: {type(e).__name__}: {e}")
     
-    os.remove(filepath)
+    release_upload(source)
     return jsonify(result)
 
 
@@ -753,14 +3203,16 @@ def dump_text():
     if 'file' not in request.files:
         return jsonify({'error': 'No file'})
     file = request.files['file']
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-    file.save(filepath)
-    doc = fitz.open(filepath)
-    pages = []
-    for i, page in enumerate(doc):
-        text = page.get_text()
-        pages.append({'page': i, 'chars': len(text), 'text': text})
-    os.remove(filepath)
+    source = read_upload(file)
+    try:
+        doc = open_pdf(source)
+        pages = []
+        for i, page in enumerate(doc):
+            text = page.get_text()
+            pages.append({'page': i, 'chars': len(text), 'text': text})
+        doc.close()
+    finally:
+        release_upload(source)
     return jsonify({'pages': pages})
 
 
@@ -772,6 +3224,7 @@ def debug():
         'python': sys.version,
         'env_has_api_key': bool(os.environ.get('ANTHROPIC_API_KEY')),
         'api_key_prefix': os.environ.get('ANTHROPIC_API_KEY', '')[:8] + '...' if os.environ.get('ANTHROPIC_API_KEY') else 'NOT SET',
+        'result_cache': result_cache.stats(),
     }
     # Check libraries
     try:
@@ -792,5 +3245,50 @@ def debug():
     return jsonify(info)
 
 
+def _admin_allowed():
+    """True when the request carries ADMIN_TOKEN; always False while none is configured"""
+    token = app.config['ADMIN_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.before_request
+def _recover_jobs_on_first_use():
+    if request.endpoint in ('create_job', 'convert_chunk', 'job_status', 'job_result'):
+        ensure_jobs_recovered()
+
+
+@app.after_request
+def _record_request(response):
+    endpoint = request.endpoint or 'unmatched'
+    if endpoint not in ('metrics_endpoint', 'static'):
+        metrics.inc('http_requests_total', (('endpoint', endpoint), ('status', str(response.status_code))))
+        metrics.observe('http_request_duration_seconds', (('endpoint', endpoint),),
+                        time.perf_counter() - g.request_start)
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Stage timings and request counts in the Prometheus text format (this process only)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/admin/vision-cache', methods=['GET', 'DELETE'])
+def admin_vision_cache():
+    """Inspect (GET) or clear (DELETE) the per-page vision response cache"""
+    if not _admin_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    if request.method == 'DELETE':
+        vision_cache.clear()
+        return jsonify({'success': True, 'stats': vision_cache.stats()})
+    vision_cache.evict_expired()
+    return jsonify({'stats': vision_cache.stats(), 'entries': vision_cache.describe()})
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,187 @@
+"""Benchmark the precompiled ABSA line/keyword classifier against the previous checks.
+
+Builds a synthetic ABSA Tjekrekeningstaat text dump (one field per line,
+with page headers, footers and every sign case) and parses it with the
+AbsaStatementParser and with the previous implementation, which tested
+block-ending lines with four separate checks, scanned the contains-skip
+list per block line and the keyword lists per sign case. Reports per-row
+cost and checks the outputs.
+
+Usage:
+    python benchmarks/bench_absa_classifier.py [--rows 50000]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+LEGACY_AMOUNT_RE = re.compile(r'^\d{1,3}(?:\s\d{3})*\.\d{2}$')
+LEGACY_ACCOUNT_NO_RE = re.compile(r'^\d{2}-\d{4}-\d{4}$')
+LEGACY_TYPE_CODES = {'T', 'A', 'D', 'G', 'K', '*'}
+LEGACY_EXACT_SKIP = {k for k, v in app.ABSA_LINE_CLASSES.items() if v == 'skip' and k}
+
+
+def legacy_absa_block_transaction(date_str, block):
+    """Previous block classifier: substring scans per line and per sign case"""
+    if not block:
+        return None
+    if 'Saldo Oorgedra' in block[0] or 'Saldo oorgedra' in block[0]:
+        return None
+    if block[0] in ('Datum', 'Transaksiebeskrywing', 'Koste'):
+        return None
+
+    amounts = []
+    desc_parts = []
+    has_type_code = False
+    has_fee_marker = False
+    for bl in block:
+        if not bl:
+            continue
+        if LEGACY_AMOUNT_RE.match(bl):
+            amounts.append(bl)
+        elif bl == '*':
+            has_fee_marker = True
+        elif bl in LEGACY_TYPE_CODES:
+            has_type_code = True
+        elif bl in LEGACY_EXACT_SKIP:
+            pass
+        elif any(cs in bl for cs in app.ABSA_CONTAINS_SKIP):
+            pass
+        elif LEGACY_ACCOUNT_NO_RE.match(bl):
+            pass
+        else:
+            desc_parts.append(bl)
+
+    if not amounts or not desc_parts:
+        return None
+
+    full_desc_lower = ' '.join(desc_parts).lower()
+    if has_fee_marker and len(amounts) == 2:
+        txn_amount = -abs(app.parse_amount(amounts[-2]))
+    elif has_type_code and len(amounts) == 3:
+        txn_amount = app.parse_amount(amounts[-2])
+        if any(k in full_desc_lower for k in ['betaal dt', 'debiet', 'betaal bewys']):
+            txn_amount = -abs(txn_amount)
+        elif any(k in full_desc_lower for k in ['betaal kt', 'krediet']):
+            txn_amount = abs(txn_amount)
+        else:
+            txn_amount = -abs(txn_amount)
+    elif has_type_code and len(amounts) == 2:
+        return None
+    elif not has_type_code and len(amounts) == 2:
+        txn_amount = app.parse_amount(amounts[-2])
+        if any(k in full_desc_lower for k in ['betaal kt', 'acb krediet', 'deposito']):
+            txn_amount = abs(txn_amount)
+        elif any(k in full_desc_lower for k in ['betaal dt', 'acb debiet', 'debiet']):
+            txn_amount = -abs(txn_amount)
+        else:
+            txn_amount = abs(txn_amount)
+    elif len(amounts) >= 2:
+        txn_amount = app.parse_amount(amounts[-2])
+        if any(k in full_desc_lower for k in ['betaal dt', 'debiet', 'fooi', 'koste', 'admin', 'mndelik']):
+            txn_amount = -abs(txn_amount)
+        else:
+            txn_amount = abs(txn_amount)
+    else:
+        return None
+
+    description = desc_parts[-1] if len(desc_parts) >= 3 else ' '.join(desc_parts)
+    return (date_str, description, txn_amount)
+
+
+class LegacyAbsaStatementParser(app.AbsaStatementParser):
+    """AbsaStatementParser with the previous block-end checks and block classifier"""
+
+    def feed(self, line):
+        line = line.strip()
+        if not self.in_section:
+            if 'U transaksies' in line:
+                self.in_section = True
+            return None
+
+        transaction = None
+        if self.date_str is not None:
+            if not (app.ABSA_DATE_RE.match(line) or 'U transaksies' in line
+                    or line.startswith('DIENSGELD') or line.startswith('KREDIETRENTE')):
+                self.block.append(line)
+                return None
+            transaction = self.flush()
+
+        if 'U transaksies (vervolg)' in line:
+            return transaction
+        if app.ABSA_DATE_RE.match(line):
+            parts = line.split('/')
+            self.date_str = f"{parts[0].zfill(2)}/{parts[1].zfill(2)}/{parts[2]}"
+            self.block = []
+        return transaction
+
+    def flush(self):
+        if self.date_str is None:
+            return None
+        date_str, block = self.date_str, self.block
+        self.date_str, self.block = None, []
+        return legacy_absa_block_transaction(date_str, block)
+
+
+BLOCKS = [
+    ['Digitale Betaal Dt', 'Absa Bank', 'Pr Markram {i}', 'T', '10.00', '{a}', '55 271.05'],
+    ['Acb Krediet', 'Some Payer {i}', '{a}', '47 320.21'],
+    ['Digitale Betaal Kt', 'Client {i}', '{a}', '72 565.94'],
+    ['Mndeliks Rek-fooi', '*', '{a}', '91 742.65'],
+    ['Acb Debiet:ekst', 'Insurer {i}', '10-0380-1108', '{a}', '12 000.00'],
+    ['Kontant Deposito', 'Branch {i}', 'G', '5.50', '{a}', '8 100.00'],
+    ['Transaksie Koste', 'A', '2.00', '4 400.00'],
+    ['Admin Koste {i}', 'K', '1.00', '2.00', '{a}', '3 000.00'],
+]
+PAGE_BREAK = ['Bladsy {p} van 99', 'Absa Bank Beperk Registrasie 1986/004794/06',
+              'Tjekrekeningstaat', 'BTW R 4940112230', 'U transaksies (vervolg)',
+              'Datum', 'Transaksiebeskrywing', 'Koste', 'Debietbedrag', 'Kredietbedrag', 'Saldo']
+
+
+def synthetic_dump(rows):
+    """ABSA statement text with rows date blocks and a header every 40 rows"""
+    out = ['Tjekrekeningstaat', 'Rekeningtipe:', 'Groeiende Besig Rek', 'U transaksies',
+           '1/11/2025', 'Saldo Oorgedra', '40 000.00']
+    for i in range(rows):
+        if i and i % 40 == 0:
+            out.extend(line.format(p=i // 40) for line in PAGE_BREAK)
+        out.append(f'{i % 28 + 1}/{i // 28 % 12 + 1}/2025')
+        amount = f'{i * 37 % 9000 + 100:,}.{i % 100:02d}'.replace(',', ' ')
+        out.extend(line.format(i=i, a=amount) for line in BLOCKS[i % len(BLOCKS)])
+    return '\n'.join(out)
+
+
+def timed(parser_cls, lines, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = list(app.iter_transactions(parser_cls(), lines))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lines = synthetic_dump(args.rows).split('\n')
+    print(f'{args.rows} rows, {len(lines)} lines')
+
+    old, old_t = timed(LegacyAbsaStatementParser, lines, args.repeat)
+    new, new_t = timed(app.AbsaStatementParser, lines, args.repeat)
+
+    print(f'legacy     {old_t:6.3f}s   {old_t / args.rows * 1e6:6.2f} us/row')
+    print(f'compiled   {new_t:6.3f}s   {new_t / args.rows * 1e6:6.2f} us/row   x{old_t / new_t:.2f}')
+    print(f'transactions: {len(new)}   identical: {old == new}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark the compiled ABSA decoder against the previous per-character loop.
+
+Builds a large garbled statement dump by re-encoding decoded ABSA text with
+the inverse of ABSA_CHAR_MAP, then times decode_absa_text and
+apply_word_corrections against the previous implementations and checks the
+outputs.
+
+The old word-correction pass replaced entries one after another in
+dictionary order, so overlapping entries (e.g. 'B/n' before 'B/nk') could
+rewrite each other's output. Lines where the two differ are listed; every
+other line must be identical.
+
+Usage:
+    python benchmarks/bench_absa_decoder.py [--lines 200000]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+def legacy_decode_absa_text(text):
+    result = ''
+    for char in text:
+        result += app.ABSA_CHAR_MAP.get(char, char)
+    return result
+
+
+def legacy_apply_word_corrections(text):
+    for wrong, right in app.ABSA_WORD_CORRECTIONS.items():
+        text = text.replace(wrong, right)
+    return text
+
+
+def encoder():
+    """Translation table from decoded text back to the garbled font encoding"""
+    inverse = {}
+    for garbled, plain in app.ABSA_CHAR_MAP.items():
+        inverse.setdefault(plain, garbled)
+    return str.maketrans(inverse)
+
+
+def decoded_dump(lines):
+    """Decoded-form ABSA statement lines, including words that need correcting"""
+    words = list(app.ABSA_WORD_CORRECTIONS)
+    out = []
+    for i in range(lines):
+        kind = i % 4
+        if kind == 0:
+            out.append(f'{i % 28 + 1:02d}/{i % 12 + 1:02d}/2025')
+        elif kind == 1:
+            out.append(f'Digit/le Bet/l Dt {words[i % len(words)]} Ref {i}')
+        elif kind == 2:
+            out.append(f'{words[(i * 7) % len(words)]} {words[(i * 13) % len(words)]}')
+        else:
+            out.append(f'{i % 900 + 10}.{i % 100:02d}')
+    return '\n'.join(out)
+
+
+def timed(fn, text):
+    start = time.perf_counter()
+    result = fn(text)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=200000)
+    args = parser.parse_args()
+
+    garbled = decoded_dump(args.lines).translate(encoder())
+    mb = len(garbled.encode()) / 1024 / 1024
+    print(f'{args.lines} lines, {mb:.1f} MB garbled text')
+
+    old_decoded, old_t = timed(legacy_decode_absa_text, garbled)
+    new_decoded, new_t = timed(app.decode_absa_text, garbled)
+    print(f'decode       legacy {mb / old_t:8.1f} MB/s   compiled {mb / new_t:8.1f} MB/s   '
+          f'x{old_t / new_t:.0f}   identical: {old_decoded == new_decoded}')
+
+    old_fixed, old_t = timed(legacy_apply_word_corrections, new_decoded)
+    new_fixed, new_t = timed(app.apply_word_corrections, new_decoded)
+    old_lines, new_lines = old_fixed.split('\n'), new_fixed.split('\n')
+    same = sum(o == n for o, n in zip(old_lines, new_lines))
+    # Reference numbers are masked so each distinct difference is listed once
+    differing = {(re.sub(r'\d+', 'N', o), re.sub(r'\d+', 'N', n))
+                 for o, n in zip(old_lines, new_lines) if o != n}
+    print(f'corrections  legacy {mb / old_t:8.1f} MB/s   compiled {mb / new_t:8.1f} MB/s   '
+          f'x{old_t / new_t:.1f}   identical lines: {same}/{len(new_lines)}')
+    if differing:
+        print('distinct lines changed by overlapping entries (legacy -> compiled):')
+        for old, new in sorted(differing)[:20]:
+            print(f'  {old!r} -> {new!r}')
+        if len(differing) > 20:
+            print(f'  ... {len(differing) - 20} more')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""Benchmark the conversion pipeline on synthetic statements for every parser.
+
+Generates FNB, Standard Bank, text ABSA and image-only (scanned) PDFs with
+fitz, with a known number of pages and rows per page. Each statement is
+run through extract_transactions_from_pdf -> create_excel_file /
+create_csv_file, and through /convert with Flask's test client. Reports
+throughput, per-stage latency percentiles (from the stage timers behind
+/metrics) and peak Python heap / RSS. Every run's row count and amount
+total must match what was generated, so a speedup cannot silently drop
+transactions; the exit status is 1 if any run does not.
+
+Image-only pages go to a local stub of the messages API, which answers
+every page with --rows rows after --vision-latency seconds. Caches are
+cleared before each run so every run does the full work.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--pages 5] [--rows 40] [--runs 3] [--kinds fnb,standard,absa,image]
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+
+import app
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+LINE_HEIGHT = 11
+MARGIN = 40
+
+
+def amount_cents(page, row):
+    """Deterministic amount in cents for a generated row; every third is a debit"""
+    cents = (page * 7919 + row * 104729) % 900000 + 101
+    return -cents if row % 3 else cents
+
+
+def money(cents, sep=','):
+    """'1,234.56' (FNB / Standard Bank) or '1 234.56' (ABSA) for abs(cents)"""
+    return f'{abs(cents) // 100:,}'.replace(',', sep) + f'.{abs(cents) % 100:02d}'
+
+
+def fnb_page(page, rows):
+    lines = ['First National Bank', f'Cheque Account Statement  Page {page + 1}',
+             'Date  Description  Amount  Balance']
+    for row in range(rows):
+        cents = amount_cents(page, row)
+        sign = '-' if cents < 0 else ''
+        lines.append(f'{row % 28 + 1} {MONTHS[page % 12]} 25 POS Purchase Shop {page}-{row} '
+                     f'{sign}{money(cents)} 12,345.67')
+    return lines
+
+
+def standard_bank_page(page, rows):
+    lines = ['Standard Bank', f'Current Account  Statement page {page + 1}',
+             'Date  Details  Debits  Credits  Balance']
+    for row in range(rows):
+        cents = amount_cents(page, row)
+        sign = '-' if cents < 0 else ''
+        lines.append(f'{row % 28 + 1:02d} {MONTHS[page % 12]} 25 IB Payment Ref {page}-{row} '
+                     f'{sign}{money(cents)} 45,678.90')
+    return lines
+
+
+def absa_page(page, rows):
+    """One field per line, as fitz extracts the Tjekrekeningstaat table"""
+    if page == 0:
+        lines = ['Absa Bank Beperk', 'Tjekrekeningstaat', 'U transaksies',
+                 '1/01/2025', 'Saldo Oorgedra', '40 000.00']
+    else:
+        lines = [f'Bladsy {page + 1} van 99', 'Absa Bank Beperk Registrasie 1986/004794/06',
+                 'Tjekrekeningstaat', 'U transaksies (vervolg)', 'Datum', 'Transaksiebeskrywing', 'Koste']
+    for row in range(rows):
+        cents = amount_cents(page, row)
+        lines.append(f'{row % 28 + 1}/{page % 12 + 1}/2025')
+        if cents > 0:
+            lines += ['Acb Krediet', f'Payer {page}-{row}', money(cents, ' '), '47 320.21']
+        elif row % 2:
+            lines += ['Digitale Betaal Dt', 'Absa Bank', f'Payee {page}-{row}', 'T', '10.00',
+                      money(cents, ' '), '55 271.05']
+        else:
+            lines += [f'Mndeliks Rek-fooi {page}-{row}', '*', money(cents, ' '), '91 742.65']
+    return lines
+
+
+def text_pdf(pages_lines):
+    """PDF bytes with each list of lines on its own page, the page as tall as it needs"""
+    doc = fitz.open()
+    for lines in pages_lines:
+        page = doc.new_page(width=595, height=max(842, 2 * MARGIN + LINE_HEIGHT * len(lines)))
+        for i, line in enumerate(lines):
+            page.insert_text((MARGIN, MARGIN + i * LINE_HEIGHT), line, fontsize=8)
+    return doc.tobytes()
+
+
+def image_pdf(pages_lines):
+    """Scanned-style PDF: each page is only a JPEG of the rendered text page"""
+    rendered = fitz.open(stream=text_pdf(pages_lines), filetype='pdf')
+    doc = fitz.open()
+    for src in rendered:
+        jpeg = src.get_pixmap(matrix=fitz.Matrix(1.5, 1.5), colorspace=fitz.csGRAY).tobytes('jpeg')
+        page = doc.new_page(width=src.rect.width, height=src.rect.height)
+        page.insert_image(page.rect, stream=jpeg)
+    return doc.tobytes()
+
+
+def synthetic_statement(kind, pages, rows):
+    """(pdf_bytes, expected_rows, expected_total_cents) for one kind of statement"""
+    make_page = {'fnb': fnb_page, 'standard': standard_bank_page, 'absa': absa_page,
+                 'image': fnb_page}[kind]
+    pages_lines = [make_page(page, rows) for page in range(pages)]
+    if kind == 'image':
+        # The stub answers every page with stub_rows(); the image only has to be unique
+        return image_pdf(pages_lines), pages * rows, pages * sum(c for _, _, c in stub_rows(rows))
+    total = sum(amount_cents(page, row) for page in range(pages) for row in range(rows))
+    return text_pdf(pages_lines), pages * rows, total
+
+
+def stub_rows(rows):
+    return [(f'{row % 28 + 1:02d}/03/2025', f'Scanned row {row}', amount_cents(99, row)) for row in range(rows)]
+
+
+class StubVisionHandler(BaseHTTPRequestHandler):
+    """Messages API stand-in: every page image gets the same rows back"""
+    protocol_version = 'HTTP/1.1'
+    rows = 0
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.latency)
+        rows = [{'date': d, 'description': desc, 'amount': cents / 100} for d, desc, cents in stub_rows(self.rows)]
+        body = json.dumps({
+            'content': [{'type': 'text', 'text': json.dumps(rows)}],
+            'usage': {'input_tokens': 1500, 'output_tokens': 40 * self.rows},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_vision(rows, latency):
+    StubVisionHandler.rows = rows
+    StubVisionHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubVisionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/v1/messages'
+
+
+def record_stage_samples():
+    """Keep every stage timer observation (the /metrics histograms only keep buckets)"""
+    samples = defaultdict(list)
+    observe = app.metrics.observe
+
+    def recording(name, labels, value):
+        if name == 'statement_stage_seconds':
+            samples[dict(labels)['stage']].append(value)
+        observe(name, labels, value)
+
+    app.metrics.observe = recording
+    return samples
+
+
+def run_pipeline(pdf, output_format):
+    transactions = app.extract_transactions_from_pdf(pdf)
+    buf = io.BytesIO()
+    with app.metrics.timer('output_write'):
+        if output_format == 'csv':
+            app.create_csv_file(transactions, buf)
+        else:
+            app.create_excel_file(transactions, buf)
+    return transactions
+
+
+def run_convert(client, pdf, output_format):
+    response = client.post('/convert', data={
+        'files[]': (io.BytesIO(pdf), 'statement.pdf'),
+        'output_format': output_format,
+    })
+    result = response.get_json()
+    if response.status_code != 200:
+        raise RuntimeError(result.get('error'))
+    # Amounts are checked from the rendered CSV itself
+    data = base64.b64decode(result['file_data'])
+    if output_format != 'csv':
+        return [None] * result['transactions']
+    rows = data.decode().splitlines()[1:]
+    return [(None, None, float(line.rsplit(',', 1)[1])) for line in rows]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def peak_rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / 1024 / 1024 if sys.platform == 'darwin' else usage / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=5, help='pages per statement')
+    parser.add_argument('--rows', type=int, default=40, help='transactions per page')
+    parser.add_argument('--runs', type=int, default=3, help='timed runs per scenario')
+    parser.add_argument('--kinds', default='fnb,standard,absa,image')
+    parser.add_argument('--vision-latency', type=float, default=0.05, help='stub seconds per page')
+    parser.add_argument('--verbose', action='store_true', help="keep the app's stderr logging")
+    args = parser.parse_args()
+
+    server, url = start_stub_vision(args.rows, args.vision_latency)
+    app.app.config['VISION_API_URL'] = url
+    app.app.config['CONVERT_WORKERS'] = 1
+    app.app.config['VISION_RATE_LIMIT'] = 1e6  # the stub is not rate limited
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark')
+    client = app.app.test_client()
+    samples = record_stage_samples()
+    quiet = contextlib.nullcontext if args.verbose else lambda: contextlib.redirect_stderr(io.StringIO())
+
+    scenarios = []
+    for kind in args.kinds.split(','):
+        pdf, expected_rows, expected_cents = synthetic_statement(kind, args.pages, args.rows)
+        scenarios += [
+            (kind, 'pipeline xlsx', lambda pdf=pdf: run_pipeline(pdf, 'xlsx'), expected_rows, expected_cents),
+            (kind, 'pipeline csv', lambda pdf=pdf: run_pipeline(pdf, 'csv'), expected_rows, expected_cents),
+            (kind, '/convert csv', lambda pdf=pdf: run_convert(client, pdf, 'csv'), expected_rows, expected_cents),
+            (kind, '/convert xlsx', lambda pdf=pdf: run_convert(client, pdf, 'xlsx'), expected_rows, None),
+        ]
+
+    print(f'{args.pages} pages x {args.rows} rows, {args.runs} runs, vision stub {args.vision_latency}s/page')
+    print(f'{"statement":<9} {"path":<14} {"s/run":>7} {"pages/s":>8} {"rows/s":>9} {"heap MB":>8}  check')
+    failures = 0
+    stage_report = []
+    for kind, path, run, expected_rows, expected_cents in scenarios:
+        samples.clear()
+        elapsed = []
+        results = []
+        with quiet():
+            for _ in range(args.runs):
+                app.result_cache.clear()
+                app.vision_cache.clear()
+                start = time.perf_counter()
+                results.append(run())
+                elapsed.append(time.perf_counter() - start)
+            stages = {stage: list(values) for stage, values in samples.items()}
+            # One more run, traced, for the Python heap peak
+            app.result_cache.clear()
+            app.vision_cache.clear()
+            tracemalloc.start()
+            run()
+            _, heap_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        problems = []
+        for transactions in results:
+            if len(transactions) != expected_rows:
+                problems.append(f'{len(transactions)} rows, expected {expected_rows}')
+            elif expected_cents is not None:
+                cents = sum(round(amount * 100) for _, _, amount in transactions)
+                if cents != expected_cents:
+                    problems.append(f'amounts total {cents / 100:.2f}, expected {expected_cents / 100:.2f}')
+        failures += bool(problems)
+        per_run = sum(elapsed) / len(elapsed)
+        print(f'{kind:<9} {path:<14} {per_run:>7.3f} {args.pages / per_run:>8.1f} '
+              f'{expected_rows / per_run:>9.0f} {heap_peak / 1024 / 1024:>8.1f}  '
+              f'{"; ".join(sorted(set(problems))) or "ok"}')
+        stage_report.append((kind, path, stages))
+
+    print()
+    print(f'{"statement":<9} {"path":<14} {"stage":<14} {"n":>5} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for kind, path, stages in stage_report:
+        for stage, values in sorted(stages.items()):
+            print(f'{kind:<9} {path:<14} {stage:<14} {len(values):>5} {percentile(values, 0.5) * 1000:>8.2f} '
+                  f'{percentile(values, 0.95) * 1000:>8.2f} {percentile(values, 0.99) * 1000:>8.2f}')
+
+    print(f'\npeak RSS {peak_rss_mb():.0f} MB')
+    server.shutdown()
+    if failures:
+        print(f'{failures} scenario(s) did not return the generated rows')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Benchmark TransactionBatch against lists of (date, description, amount) tuples.
+
+Builds a combined multi-year export the way /convert does (one batch per
+statement, then concatenated and sign-inverted) with both representations
+and reports the memory held by the result (tracemalloc) and the time taken.
+Both must render identical CSV output.
+
+Usage:
+    python benchmarks/bench_transaction_batch.py [--rows 200000] [--files 12]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+def synthetic_statement(rows, seed):
+    """One statement's raw rows: recurring payees, dates spread over a year"""
+    for i in range(rows):
+        day = (i + seed) % 28 + 1
+        month = (i // 28 + seed) % 12 + 1
+        amount = round(((i * 37 + seed) % 100000) / 7 + 0.01, 2)
+        yield (f'{day:02d}/{month:02d}/{2015 + seed}', f'Digitale Betaal Dt Absa Bank Payee {(i + seed) % 400}',
+               -amount if i % 3 else amount)
+
+
+def build_lists(files, rows):
+    statements = [list(synthetic_statement(rows, seed)) for seed in range(files)]
+    combined = []
+    for transactions in statements:
+        combined.extend(transactions)
+    return statements, [(d, desc, -amt) for d, desc, amt in combined]
+
+
+def build_batches(files, rows):
+    statements = [app.TransactionBatch.from_rows(synthetic_statement(rows, seed)) for seed in range(files)]
+    return statements, app.TransactionBatch.concat(statements).invert()
+
+
+def measure(build, files, rows):
+    """Build time without tracing, then memory held by a second, traced build"""
+    start = time.perf_counter()
+    build(files, rows)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = build(files, rows)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000, help='rows in the combined export')
+    parser.add_argument('--files', type=int, default=12, help='statements combined')
+    args = parser.parse_args()
+    per_file = args.rows // args.files
+
+    print(f'{args.files} statements x {per_file} rows')
+    print(f'{"representation":<16} {"build s":>8} {"held MB":>8} {"bytes/row":>10}')
+    outputs = []
+    for name, build in (('tuple lists', build_lists), ('TransactionBatch', build_batches)):
+        (_, combined), elapsed, held = measure(build, args.files, per_file)
+        print(f'{name:<16} {elapsed:>8.2f} {held / 1024 / 1024:>8.1f} {held / len(combined):>10.0f}')
+        buf = BytesIO()
+        app.create_csv_file(combined, buf)
+        outputs.append(buf.getvalue())
+    print(f'identical CSV: {outputs[0] == outputs[1]}')
+
+
+if __name__ == '__main__':
+    main()
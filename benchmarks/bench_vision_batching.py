@@ -0,0 +1,131 @@
+"""Compare single-page and batched vision requests on a scanned statement.
+
+Generates an image-only statement (see bench_pipeline.py) and reads it
+through vision_transactions_by_page with VISION_PAGES_PER_REQUEST=1 and
+with larger batches. The messages API is a local stub that models usage
+and latency: input tokens for the system prompt, each image and each
+text block, output tokens for the JSON it returns, and a round-trip cost
+plus a per-output-token generation time. Batched requests get rows
+tagged with the page label that preceded each image, as the prompt asks.
+
+Reports requests, usage tokens, estimated cost per statement and wall
+time for each mode, and checks every page got its rows back.
+
+Usage:
+    python benchmarks/bench_vision_batching.py [--pages 12] [--rows 30] [--batch 1,2,4,6]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from bench_pipeline import fnb_page, image_pdf
+
+IMAGE_TOKENS = 1600  # about width * height / 750 for a page at VISION_MAX_PIXELS
+PAGE_LABEL_RE = re.compile(r'^Page (\d+):$')
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class ModelStubHandler(BaseHTTPRequestHandler):
+    """Messages API stand-in that charges tokens and time like a real model"""
+    protocol_version = 'HTTP/1.1'
+    rows = 0
+    round_trip = 0.0
+    token_time = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        content = payload['messages'][0]['content']
+        input_tokens = estimate_tokens(payload['system'])
+        labels = []
+        for block in content:
+            if block['type'] == 'image':
+                input_tokens += IMAGE_TOKENS
+            else:
+                input_tokens += estimate_tokens(block['text'])
+                match = PAGE_LABEL_RE.match(block['text'])
+                if match:
+                    labels.append(int(match.group(1)))
+        rows = []
+        for label in labels or [None]:
+            for row in range(self.rows):
+                item = {'date': f'{row % 28 + 1:02d}/03/2025', 'description': f'Scanned row {row}',
+                        'amount': -12.5 if row % 3 else 100.0}
+                rows.append(item if label is None else {'page': label, **item})
+        text = json.dumps(rows)
+        output_tokens = estimate_tokens(text)
+        time.sleep(self.round_trip + output_tokens * self.token_time)
+        body = json.dumps({
+            'content': [{'type': 'text', 'text': text}],
+            'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=12)
+    parser.add_argument('--rows', type=int, default=30, help='rows per page')
+    parser.add_argument('--batch', default='1,2,4,6', help='pages per request to compare')
+    parser.add_argument('--round-trip', type=float, default=0.6, help='stub seconds per request')
+    parser.add_argument('--token-time', type=float, default=0.0005, help='stub seconds per output token')
+    parser.add_argument('--input-price', type=float, default=3.0, help='$ per million input tokens')
+    parser.add_argument('--output-price', type=float, default=15.0, help='$ per million output tokens')
+    args = parser.parse_args()
+
+    ModelStubHandler.rows = args.rows
+    ModelStubHandler.round_trip = args.round_trip
+    ModelStubHandler.token_time = args.token_time
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ModelStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app.app.config['VISION_API_URL'] = f'http://127.0.0.1:{server.server_address[1]}/v1/messages'
+    app.app.config['VISION_RATE_LIMIT'] = 1e6  # the stub is not rate limited
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark')
+
+    pdf = image_pdf([fnb_page(page, args.rows) for page in range(args.pages)])
+    with contextlib.redirect_stderr(io.StringIO()):
+        pages = app.load_pdf_pages(pdf)
+    print(f'{args.pages} scanned pages x {args.rows} rows, {app.app.config["VISION_MAX_WORKERS"]} requests in flight')
+    print(f'{"pages/req":>9} {"requests":>8} {"input tok":>10} {"output tok":>10} {"cost $":>8} {"wall s":>7}  check')
+
+    failed = False
+    for batch in (int(b) for b in args.batch.split(',')):
+        app.app.config['VISION_PAGES_PER_REQUEST'] = batch
+        app.vision_cache.clear()
+        usage, errors = {}, []
+        with contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            by_page = app.vision_transactions_by_page(pages, errors, usage=usage)
+            elapsed = time.perf_counter() - start
+        short = [n for n in range(args.pages) if len(by_page.get(n, [])) != args.rows]
+        failed |= bool(short or errors)
+        cost = (usage['input_tokens'] * args.input_price + usage['output_tokens'] * args.output_price) / 1e6
+        print(f'{batch:>9} {usage["requests"]:>8} {usage["input_tokens"]:>10} {usage["output_tokens"]:>10} '
+              f'{cost:>8.4f} {elapsed:>7.2f}  {"ok" if not (short or errors) else f"pages short: {short} {errors}"}')
+
+    server.shutdown()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark the write-only XLSX writer against the previous in-memory writer.
+
+Each writer runs in its own child process so peak RSS is measured in
+isolation. Reports rows/sec and peak RSS growth while writing.
+
+Usage:
+    python benchmarks/bench_xlsx_writer.py [--rows 100000]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import Workbook
+from openpyxl.styles import Font, PatternFill, Alignment
+
+
+def legacy_create_excel_file(transactions, output_path):
+    """Previous create_excel_file: normal workbook, one Font per negative cell"""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Transactions"
+
+    header_fill = PatternFill(start_color="1F4E79", end_color="1F4E79", fill_type="solid")
+    header_font = Font(color="FFFFFF", bold=True)
+    headers = ['Date', 'Description', 'Amount']
+    for col, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col, value=header)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = Alignment(horizontal='center')
+
+    for row_idx, (date_str, description, amount) in enumerate(transactions, 2):
+        ws.cell(row=row_idx, column=1, value=date_str)
+        ws.cell(row=row_idx, column=2, value=description)
+        amount_cell = ws.cell(row=row_idx, column=3, value=amount)
+        if amount < 0:
+            amount_cell.font = Font(color="C00000")
+
+    ws.column_dimensions['A'].width = 15
+    ws.column_dimensions['B'].width = 60
+    ws.column_dimensions['C'].width = 15
+
+    wb.save(output_path)
+
+
+def synthetic_transactions(rows):
+    """Generator of (date, description, amount) rows, roughly half negative"""
+    for i in range(rows):
+        day = i % 28 + 1
+        month = i // 28 % 12 + 1
+        amount = round((i * 37 % 10000) / 7, 2)
+        yield (f'{day:02d}/{month:02d}/2025', f'Digitale Betaal Dt Absa Bank Payee {i % 500}',
+               -amount if i % 2 else amount)
+
+
+def peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+def run_child(writer, rows):
+    """Write rows with one writer and print 'seconds peak_rss_delta_kb bytes'"""
+    import app
+    create = app.create_excel_file if writer == 'write-only' else legacy_create_excel_file
+    baseline = peak_rss_kb()
+    buf = BytesIO()
+    start = time.perf_counter()
+    create(synthetic_transactions(rows), buf)
+    elapsed = time.perf_counter() - start
+    print(f'{elapsed} {peak_rss_kb() - baseline} {len(buf.getvalue())}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--child', choices=['legacy', 'write-only'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.rows)
+        return
+
+    print(f'{args.rows} rows')
+    print(f'{"writer":<12} {"seconds":>8} {"rows/sec":>10} {"peak RSS +MB":>13} {"size KB":>8}')
+    for writer in ('legacy', 'write-only'):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', writer, '--rows', str(args.rows)],
+            check=True, capture_output=True, text=True,
+        ).stdout.split()
+        elapsed, rss_kb, size = float(out[0]), int(out[1]), int(out[2])
+        print(f'{writer:<12} {elapsed:>8.2f} {args.rows / elapsed:>10.0f} {rss_kb / 1024:>13.1f} {size / 1024:>8.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""ABSA sign keyword matching against the plain substring checks it replaced.
+
+Run with: python -m unittest discover tests  (or python -m pytest tests)
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+def substring_keywords(description):
+    lowered = description.lower()
+    return {kw for kw in app.ABSA_SIGN_KEYWORDS if kw in lowered}
+
+
+class AbsaSignKeywordsTest(unittest.TestCase):
+
+    def test_overlapping_keywords(self):
+        for description in ('MNDELIKREDIET', 'Maandelikse Fooi Mndelikoste', 'ACB KREDIET Betaal Dt',
+                            'betaal ktbetaal bewys', 'Admin Koste debiet', 'Deposito'):
+            self.assertEqual(app.absa_sign_keywords(description), substring_keywords(description), description)
+        self.assertEqual(app.absa_sign(app.absa_sign_keywords('MNDELIKREDIET'), 'type_coded'), 1)
+
+    def test_matches_substring_checks(self):
+        rnd = random.Random(0)
+        pieces = app.ABSA_SIGN_KEYWORDS + ['x', 'e', 'k', 't ', ' ']
+        for _ in range(5000):
+            parts = [rnd.choice(pieces) for _ in range(4)]
+            description = ''.join(p[rnd.randrange(len(p)):] if rnd.random() < 0.3 else p for p in parts)
+            self.assertEqual(app.absa_sign_keywords(description), substring_keywords(description), description)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""VisionClient retries, Retry-After, backoff and the shared token bucket against a local stub server.
+
+Run with: python -m unittest discover tests  (or python -m pytest tests)
+"""
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """Answers each request with the next (status, headers, delay) from `script`, then 200s.
+
+    Records when each request arrived in `hits`.
+    """
+    protocol_version = 'HTTP/1.1'
+    script = []
+    hits = []
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        with self.lock:
+            type(self).hits.append(time.monotonic())
+            status, headers, delay = self.script.pop(0) if self.script else (200, {}, 0.0)
+        time.sleep(delay)
+        if status == 200:
+            body = {'content': [{'type': 'text', 'text': '[]'}], 'usage': {'input_tokens': 1, 'output_tokens': 1}}
+        else:
+            body = {'type': 'error', 'error': {'type': 'stub', 'message': f'status {status}'}}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class VisionClientTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), ScriptedHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}/v1/messages'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        ScriptedHandler.script = []
+        ScriptedHandler.hits = []
+
+    def client(self, max_retries=3, backoff_base=0.01):
+        return app.VisionClient(self.url, rate_per_minute=6000, burst=4, max_retries=max_retries,
+                                backoff_base=backoff_base, backoff_max=1.0, timeout=10)
+
+    def post(self, client):
+        return client.post(app.vision_page_payload('eA=='), 'key')
+
+    def test_retry_after_is_honoured(self):
+        ScriptedHandler.script = [(429, {'Retry-After': '0.4'}, 0.0)]
+        result = self.post(self.client(backoff_base=0.0))  # backoff alone would not wait at all
+        self.assertEqual(result['content'][0]['text'], '[]')
+        self.assertEqual(len(ScriptedHandler.hits), 2)
+        self.assertGreaterEqual(ScriptedHandler.hits[1] - ScriptedHandler.hits[0], 0.4)
+
+    def test_overloaded_and_server_errors_are_retried(self):
+        ScriptedHandler.script = [(529, {}, 0.0), (503, {}, 0.0), (500, {}, 0.0)]
+        self.post(self.client())
+        self.assertEqual(len(ScriptedHandler.hits), 4)
+
+    def test_retries_give_up_after_max_retries(self):
+        ScriptedHandler.script = [(500, {}, 0.0)] * 3
+        with self.assertRaises(app.VisionAPIError) as caught:
+            self.post(self.client(max_retries=1))
+        self.assertEqual(caught.exception.status, 500)
+        self.assertEqual(len(ScriptedHandler.hits), 2)
+
+    def test_bad_request_is_not_retried(self):
+        ScriptedHandler.script = [(400, {}, 0.0)]
+        with self.assertRaises(app.VisionAPIError) as caught:
+            self.post(self.client())
+        self.assertEqual(caught.exception.status, 400)
+        self.assertEqual(len(ScriptedHandler.hits), 1)
+
+    def test_rate_limit_hold_delays_other_threads(self):
+        # The 429 arrives late, so a hold that forgot the time since the last
+        # acquire would let the other thread straight through
+        ScriptedHandler.script = [(429, {'Retry-After': '0.5'}, 0.3)]
+        client = self.client(backoff_base=0.0)
+        first = threading.Thread(target=self.post, args=(client,))
+        first.start()
+        time.sleep(0.35)  # the 429 has been received and the bucket held
+        self.post(client)
+        first.join()
+        rate_limited_at = ScriptedHandler.hits[0] + 0.3
+        self.assertEqual(len(ScriptedHandler.hits), 3)
+        for hit in ScriptedHandler.hits[1:]:
+            self.assertGreaterEqual(hit - rate_limited_at, 0.45)
+
+    def test_token_bucket_hold_survives_idle_time(self):
+        bucket = app.TokenBucket(rate=20.0, burst=4)
+        for _ in range(4):
+            bucket.acquire()
+        time.sleep(0.3)  # enough to refill the whole burst
+        bucket.hold(0.25)
+        start = time.monotonic()
+        bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+"""Concurrent page reads in vision_transactions_by_page against a local stub server.
+
+Run with: python -m unittest discover tests  (or python -m pytest tests)
+"""
+import base64
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+import uuid
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+class PageStubHandler(BaseHTTPRequestHandler):
+    """Reads page numbers from the image bytes ("page-<n>-...") and returns one row per page.
+
+    Rows for a request with several images are tagged with the 1-based
+    page, as the batch prompt asks. Pages in `delays` answer after that
+    many seconds; pages in `fail` get a 400.
+    """
+    protocol_version = 'HTTP/1.1'
+    delays = {}
+    fail = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        images = [block['source']['data'] for block in payload['messages'][0]['content'] if block['type'] == 'image']
+        numbers = [int(base64.b64decode(image).split(b'-')[1]) for image in images]
+        time.sleep(max(self.delays.get(n, 0.0) for n in numbers))
+        if self.fail & set(numbers):
+            status, body = 400, {'type': 'error', 'error': {'type': 'invalid_request_error', 'message': 'bad image'}}
+        else:
+            rows = [{'date': '01/02/2025', 'description': f'page {n}', 'amount': -n} for n in numbers]
+            if len(numbers) > 1:
+                rows = [{'page': n + 1, **row} for n, row in zip(numbers, rows)]
+            status, body = 200, {'content': [{'type': 'text', 'text': json.dumps(rows)}], 'usage': {}}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except OSError:
+            pass  # the client gave up on this page
+
+
+class VisionPagesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), PageStubHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.saved = dict(app.app.config)
+        app.app.config.update({
+            'VISION_API_URL': f'http://127.0.0.1:{self.server.server_address[1]}/v1/messages',
+            'VISION_RATE_LIMIT': 1e6,
+            'VISION_MAX_RETRIES': 0,
+            'VISION_MAX_WORKERS': 4,
+            'VISION_PAGES_PER_REQUEST': 1,
+            'VISION_DEADLINE': 30,
+        })
+        env = mock.patch.dict(os.environ, {'ANTHROPIC_API_KEY': 'key'})
+        env.start()
+        self.addCleanup(env.stop)
+        PageStubHandler.delays = {}
+        PageStubHandler.fail = set()
+        # Fresh image bytes per test, so nothing is served from the vision cache
+        run = uuid.uuid4().hex.encode()
+        self.pages = [{'number': n, 'image': b'page-%d-%s' % (n, run), 'image_source': 'embedded'}
+                      for n in range(4)]
+
+    def tearDown(self):
+        app.app.config.update(self.saved)
+
+    def test_pages_finishing_out_of_order_come_back_in_page_order(self):
+        PageStubHandler.delays = {0: 0.4, 1: 0.2, 2: 0.1}
+        finished = []
+        errors = []
+        by_page = app.vision_transactions_by_page(self.pages, errors, on_page=lambda n, found: finished.append(n))
+        self.assertEqual(errors, [])
+        self.assertEqual(finished, [3, 2, 1, 0])
+        self.assertEqual({n: rows[0][1] for n, rows in by_page.items()},
+                         {n: f'page {n}' for n in range(4)})
+        transactions = app.extract_via_vision(self.pages)
+        self.assertEqual([amount for _, _, amount in transactions], [0, -1, -2, -3])
+
+    def test_failing_page_is_reported_and_the_others_kept(self):
+        PageStubHandler.fail = {2}
+        errors = []
+        by_page = app.vision_transactions_by_page(self.pages, errors)
+        self.assertEqual(sorted(by_page), [0, 1, 3])
+        self.assertEqual([e['page'] for e in errors], [2])
+        self.assertIn('400', errors[0]['error'])
+
+    def test_deadline_stops_outstanding_pages(self):
+        app.app.config['VISION_DEADLINE'] = 0.5
+        PageStubHandler.delays = {1: 3.0, 3: 3.0}
+        errors = []
+        start = time.monotonic()
+        by_page = app.vision_transactions_by_page(self.pages, errors)
+        self.assertLess(time.monotonic() - start, 2.0)
+        self.assertEqual(sorted(by_page), [0, 2])
+        self.assertEqual(errors, [{'page': 1, 'error': 'deadline exceeded'},
+                                  {'page': 3, 'error': 'deadline exceeded'}])
+
+    def test_batched_reads_are_cached_under_the_batch_prompt(self):
+        app.app.config['VISION_PAGES_PER_REQUEST'] = 2
+
+        def requests():
+            usage = {}
+            by_page = app.vision_transactions_by_page(self.pages, usage=usage)
+            self.assertEqual(sorted(by_page), [0, 1, 2, 3])
+            return usage['requests']
+
+        self.assertEqual(requests(), 2)
+        image = self.pages[0]['image']
+        self.assertIsNotNone(app.vision_cache.get(app.vision_cache_key(image, batched=True)))
+        self.assertIsNone(app.vision_cache.get(app.vision_cache_key(image)))
+        self.assertEqual(requests(), 0)
+        # A batched read does not stand in for a single-page one...
+        app.app.config['VISION_PAGES_PER_REQUEST'] = 1
+        self.assertEqual(requests(), 4)
+        # ...and a new batch prompt reads the pages again
+        app.app.config['VISION_PAGES_PER_REQUEST'] = 2
+        app.vision_cache.clear()
+        self.assertEqual(requests(), 2)
+        with mock.patch.object(app, 'VISION_BATCH_PROMPT', app.VISION_BATCH_PROMPT + ' '):
+            self.assertEqual(requests(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+"""VisionClient streaming and truncated-reply continuation against a local stub server.
+
+Run with: python -m unittest discover tests  (or python -m pytest tests)
+"""
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+class StubMessagesHandler(BaseHTTPRequestHandler):
+    """Streams `total` rows as server-sent events, at most `per_reply` per response.
+
+    A request whose last message is a prefilled assistant turn continues
+    after the rows in it, as the messages API does. Each reply waits
+    `delay` seconds first.
+    """
+    protocol_version = 'HTTP/1.1'
+    total = 5
+    per_reply = 5
+    chunked = False
+    delay = 0.0
+    hits = []
+    peers = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        type(self).hits.append(payload)
+        type(self).peers.add(self.client_address)
+        time.sleep(self.delay)
+        messages = payload['messages']
+        done, text = 0, '```json\n['
+        if messages[-1]['role'] == 'assistant':
+            done, text = len(json.loads(messages[-1]['content'].rstrip(',') + ']')), ''
+        rows = [{'date': '01/02/2025', 'description': f'row {i} [x] "q"', 'amount': -i}
+                for i in range(done, self.total)]
+        reply = rows[:self.per_reply]
+        finished = len(reply) == len(rows)
+        text += ','.join(json.dumps(row) for row in reply) + (']\n```' if finished else ',{"date":"0')
+        events = [('message_start', {'message': {'usage': {'input_tokens': 100}}})]
+        events += [('content_block_delta', {'delta': {'type': 'text_delta', 'text': text[i:i + 9]}})
+                   for i in range(0, len(text), 9)]
+        events += [('message_delta', {'delta': {'stop_reason': 'end_turn' if finished else 'max_tokens'},
+                                      'usage': {'output_tokens': 10}}),
+                   ('message_stop', {})]
+        body = ''.join(f'event: {name}\ndata: {json.dumps(data)}\n\n' for name, data in events).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        if self.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.write(f'{len(body):x}\r\n'.encode() + body + b'\r\n0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+class VisionStreamTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubMessagesHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.saved = dict(app.app.config)
+        app.app.config['VISION_API_URL'] = f'http://127.0.0.1:{self.server.server_address[1]}/v1/messages'
+        app.app.config['VISION_RATE_LIMIT'] = 1e6
+        app.app.config['VISION_MAX_RETRIES'] = 0
+        app.app.config['VISION_MAX_CONTINUATIONS'] = 2
+        StubMessagesHandler.total = StubMessagesHandler.per_reply = 5
+        StubMessagesHandler.chunked = False
+        StubMessagesHandler.delay = 0.0
+        StubMessagesHandler.hits = []
+        StubMessagesHandler.peers = set()
+
+    def tearDown(self):
+        app.app.config.update(self.saved)
+
+    def test_sequential_streams_reuse_one_connection(self):
+        for chunked in (False, True):
+            StubMessagesHandler.chunked = chunked
+            StubMessagesHandler.hits = []
+            StubMessagesHandler.peers = set()
+            app.app.config['VISION_BURST'] = 5 + chunked  # a fresh client (and connection pool) per mode
+            client = app.get_vision_client()
+            for _ in range(3):
+                events = [event for event, _ in client.stream(app.vision_page_payload('eA=='), 'key')]
+                self.assertEqual(events[-1], 'message_stop')
+            self.assertEqual(len(StubMessagesHandler.hits), 3)
+            self.assertEqual(len(StubMessagesHandler.peers), 1)
+
+    def test_complete_reply(self):
+        usage = {'requests': 0, 'input_tokens': 0, 'output_tokens': 0}
+        rows, truncated = app.vision_stream_rows(app.vision_page_payload('eA=='), 'key', usage=usage)
+        self.assertIsNone(truncated)
+        self.assertEqual([row['amount'] for row in rows], [0, -1, -2, -3, -4])
+        self.assertEqual(rows[1]['description'], 'row 1 [x] "q"')
+        self.assertEqual(usage, {'requests': 1, 'input_tokens': 100, 'output_tokens': 10})
+        self.assertTrue(StubMessagesHandler.hits[0]['stream'])
+
+    def test_truncated_reply_is_continued(self):
+        StubMessagesHandler.total, StubMessagesHandler.per_reply = 12, 5
+        rows, truncated = app.vision_stream_rows(app.vision_page_payload('eA=='), 'key')
+        self.assertIsNone(truncated)
+        self.assertEqual([row['amount'] for row in rows], [-i if i else 0 for i in range(12)])
+        # One server hit per logical request: the first reply and two follow-ups
+        self.assertEqual(len(StubMessagesHandler.hits), 3)
+        prefill = StubMessagesHandler.hits[2]['messages'][-1]
+        self.assertEqual(prefill['role'], 'assistant')
+        self.assertEqual(len(json.loads(prefill['content'].rstrip(',') + ']')), 10)
+
+    def test_rows_kept_when_continuations_run_out(self):
+        StubMessagesHandler.total, StubMessagesHandler.per_reply = 12, 5
+        app.app.config['VISION_MAX_CONTINUATIONS'] = 1
+        rows, truncated = app.vision_stream_rows(app.vision_page_payload('eA=='), 'key')
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(truncated, 'stopped at max_tokens')
+        self.assertEqual(len(StubMessagesHandler.hits), 2)
+
+    def test_no_request_after_deadline(self):
+        client = app.get_vision_client()
+        with self.assertRaises(TimeoutError):
+            list(client.stream(app.vision_page_payload('eA=='), 'key', deadline=time.monotonic() - 1))
+        self.assertEqual(StubMessagesHandler.hits, [])
+        self.assertFalse(app.TokenBucket(10, 5).acquire(deadline=time.monotonic() - 1))
+
+    def test_no_continuation_after_deadline(self):
+        StubMessagesHandler.total, StubMessagesHandler.per_reply = 12, 5
+        StubMessagesHandler.delay = 0.3
+        rows, truncated = app.vision_stream_rows(app.vision_page_payload('eA=='), 'key',
+                                                 deadline=time.monotonic() + 0.1)
+        self.assertEqual(len(rows), 5)
+        self.assertIn('deadline reached', truncated)
+        self.assertEqual(len(StubMessagesHandler.hits), 1)
+
+    def test_json_array_stream_pieces(self):
+        parser = app.JsonArrayStream()
+        rows = []
+        for ch in 'Here:\n```json\n[{"a": "x\\"]}"}, {"b": [1, {"c": 2}]}]\n```':
+            rows += parser.feed(ch)
+        self.assertEqual(rows, [{'a': 'x"]}'}, {'b': [1, {'c': 2}]}])
+        self.assertTrue(parser.done)
+
+
+if __name__ == '__main__':
+    unittest.main()